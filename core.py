@@ -0,0 +1,1262 @@
+"""
+不依赖pygame的游戏核心：砖块、玩家、水晶、背包和换层
+Simulation之间互不影响，可以同时创建多个，也可以在进程池中无界面、远快于实时地模拟
+main.py中的同名类只负责绘制和声音，通过Simulation.events得知发生了什么
+"""
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from random import Random
+from typing import Callable, Tuple, Union
+
+screen_size = (400, 600)
+brick_len = 40
+# 每层的宽度和深度（格子数），以及每层底部sub_brick的行数
+world_size = (10, 100)
+sub_rows = 5
+# 产生砖块的参数：放水晶的空位置的比例，石头在砖块中的比例（None为与其他颜色相同）
+crystal_rate = 0.01
+stone_rate = None
+# 窗口能显示的行数
+screen_rows = screen_size[1] // brick_len
+# 砖块按块产生和逐出：每块的行数，镜头下方预先产生的块数，镜头上方保留的块数
+chunk_rows = 20
+chunk_ahead = 1
+chunk_keep = 1
+
+# 每一步的输入是一个整数：按住的键
+KEY_SPACE = 1
+KEY_UP = 2
+KEY_DOWN = 4
+KEY_LEFT = 8
+KEY_RIGHT = 16
+# 命令：重新开始移动、破坏的冷却
+KEY_MOVE_COOL = 32
+KEY_DESTROY_COOL = 64
+# 从这一位开始为使用的水晶颜色 + 1，0为不使用
+KEY_CRYSTAL_SHIFT = 8
+
+
+def pixel_units(gird_pos: list[int, int]) -> list[int, int]:
+    """将gird_pos（格子位置）换算成pos（像素位置）"""
+    x = gird_pos[0] * brick_len
+    y = gird_pos[1] * brick_len
+    return [x, y]
+
+
+class Stone:
+    color = 8
+    max_health = 5
+
+
+class BrickGrid:
+    """
+    一层砖块的紧凑储存：颜色、石头血量、所属的链各占一个平面数组
+    内存中只保留[top, bottom)行，按块（chunk_rows行）在下方产生、在上方逐出
+    下标为 (gy - top) * width + gx，即按行储存
+    """
+    EMPTY = 0xFF
+
+    def __init__(self, width: int = world_size[0], depth: int = world_size[1]):
+        self.width = width
+        self.depth = depth
+        self.top = 0
+        self.bottom = 0
+        # 颜色平面，EMPTY代表没有砖块
+        self.color = bytearray()
+        # 石头血量平面，土块恒为0
+        self.health = bytearray()
+        # 所属的链，0代表不属于任何链
+        self.chain = array('I')
+
+    def index(self, gx: int, gy: int) -> int:
+        return (gy - self.top) * self.width + gx
+
+    def pos(self, index: int) -> Tuple[int, int]:
+        """与index相反，返回下标对应的gird_pos"""
+        return index % self.width, index // self.width + self.top
+
+    def in_bounds(self, gx: int, gy: int) -> bool:
+        return 0 <= gx < self.width and self.top <= gy < self.bottom
+
+    def clear(self):
+        self.top = 0
+        self.bottom = 0
+        self.color = bytearray()
+        self.health = bytearray()
+        self.chain = array('I')
+
+    def next_rows(self) -> int:
+        """下一块的行数，这一层的最后一块可能不满chunk_rows行"""
+        return min(chunk_rows - self.bottom % chunk_rows, self.depth - self.bottom)
+
+    def get(self, gx: int, gy: int) -> Union[int, None]:
+        """返回颜色，空位置、边界外或不在内存中的行返回None"""
+        if not self.in_bounds(gx, gy):
+            return None
+        color = self.color[(gy - self.top) * self.width + gx]
+        return None if color == self.EMPTY else color
+
+    def remove(self, index: int):
+        self.color[index] = self.EMPTY
+        self.health[index] = 0
+        self.chain[index] = 0
+
+    def append(self, color: bytes, health: bytes):
+        """在最下方加入一块"""
+        self.color += color
+        self.health += health
+        self.chain.extend(array('I', bytes(4 * len(color))))
+        self.bottom += len(color) // self.width
+
+    def pop_top(self) -> Tuple[bytes, bytes]:
+        """移除最上方的一块，返回它的颜色和血量"""
+        size = chunk_rows * self.width
+        color, health = bytes(self.color[:size]), bytes(self.health[:size])
+        del self.color[:size]
+        del self.health[:size]
+        del self.chain[:size]
+        self.top += chunk_rows
+        return color, health
+
+    def push_top(self, color: bytes, health: bytes):
+        """与pop_top相反，把一块放回最上方"""
+        self.color[:0] = color
+        self.health[:0] = health
+        self.chain[:0] = array('I', bytes(4 * len(color)))
+        self.top -= chunk_rows
+
+
+class ChunkSpill:
+    """
+    被逐出的块保存在内存映射的临时文件里，第k块（从top为k * chunk_rows的行开始）位于k * chunk_bytes处
+    块中的水晶另外按块保存，同一格中可以有多个水晶
+    """
+
+    def __init__(self, width: int):
+        self.chunk_bytes = 2 * chunk_rows * width
+        self.file = tempfile.TemporaryFile()
+        self.map: Union[mmap.mmap, None] = None
+        # 块的序号 -> 其中的水晶
+        self.crystals: dict[int, list['Crystal']] = {}
+
+    def write(self, k: int, color: bytes, health: bytes, crystals: list['Crystal']):
+        self.crystals[k] = crystals
+        end = (k + 1) * self.chunk_bytes
+        if self.map is None or len(self.map) < end:
+            # 文件按两倍增长，减少重新映射的次数
+            size = max(end, 2 * len(self.map) if self.map else end)
+            if self.map is not None:
+                self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), size)
+        self.map[end - self.chunk_bytes:end] = color + health
+
+    def read(self, k: int) -> Tuple[bytes, bytes]:
+        start = k * self.chunk_bytes
+        half = self.chunk_bytes // 2
+        return self.map[start:start + half], self.map[start + half:start + self.chunk_bytes]
+
+    def take_crystals(self, k: int) -> list['Crystal']:
+        """取出第k块中的水晶，读回这一块时调用"""
+        return self.crystals.pop(k, [])
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+
+
+class FloorGenerator:
+    """
+    由种子产生一层，可以在工作线程中调用
+    每块由种子和块的top单独决定，所以产生的顺序不影响结果，同一个种子总会产生同样的一层
+    """
+
+    def __init__(self, seed: int, colors: Union[list[int, ...], None] = None,
+                 crystal_rate_: float = crystal_rate, stone_rate_: Union[float, None] = stone_rate,
+                 sub_rows_: int = sub_rows, width: int = world_size[0], depth: int = world_size[1]):
+        self.seed = seed
+        self.colors: list[int, ...] = Random(seed).sample(range(9), 5) if colors is None else colors
+        self.sub_rows = sub_rows_
+        self.width = width
+        self.depth = depth
+        # 每个格子的取值及其累计权重，EMPTY代表放水晶的空位置
+        if stone_rate_ is None or Stone.color not in self.colors:
+            weights = [1 / len(self.colors)] * len(self.colors)
+        else:
+            soil_rate = (1 - stone_rate_) / (len(self.colors) - 1)
+            weights = [stone_rate_ if color == Stone.color else soil_rate for color in self.colors]
+        self.values = self.colors + [BrickGrid.EMPTY]
+        self.cum_weights = list(itertools.accumulate([w * (1 - crystal_rate_) for w in weights] + [crystal_rate_]))
+
+    def chunk(self, top: int, rows: int) -> Tuple[bytearray, list]:
+        """
+        一次产生从top行开始的rows行
+        :return: 颜色平面，以及其中的水晶[(颜色, gird_pos), ...]
+        """
+        rng = Random(f'{self.seed}:{top}')
+        brick_rows = max(min(top + rows, self.depth - self.sub_rows) - top, 0)
+        color = bytearray(rng.choices(self.values, cum_weights=self.cum_weights, k=brick_rows * self.width))
+        color += bytes([31]) * ((rows - brick_rows) * self.width)
+        # 空位置放水晶
+        indexes = []
+        index = color.find(BrickGrid.EMPTY)
+        while index != -1:
+            indexes.append(index)
+            index = color.find(BrickGrid.EMPTY, index + 1)
+        crystals = [(cry_color, [index % self.width, top + index // self.width])
+                    for index, cry_color in zip(indexes, rng.choices(self.colors, k=len(indexes)))]
+        return color, crystals
+
+
+class FloorPlan:
+    """预先产生的一层：产生器，以及最上方的几块"""
+
+    def __init__(self, seed: int):
+        self.generator = FloorGenerator(seed)
+        self.chunks: list[Tuple[bytearray, list]] = []
+        top = 0
+        for _ in range(chunk_ahead + 1):
+            rows = min(chunk_rows, self.generator.depth - top)
+            if rows <= 0:
+                break
+            self.chunks.append(self.generator.chunk(top, rows))
+            top += rows
+
+
+class Field:
+    """
+    一层的砖块和链：产生、逐出、读回块，破坏砖块
+    变化通过Simulation.events通知绘制：('rows', top, bottom)、('evict', top)、('clear',)、
+    ('destroy', 颜色, gx, gy)、('damage', gx, gy)
+    """
+
+    def __init__(self, sim: 'Simulation'):
+        self.sim = sim
+        self.grid = BrickGrid()
+        self.spill = ChunkSpill(self.grid.width)
+        # chain2的每一个元素为chain1，chain1是该链所有砖块在grid中的下标
+        self.chain2: list[Union[list[int], None]] = []
+        # 已释放、可以复用的链序号
+        self.free_chains: list[int] = []
+        # 有砖块被破坏、需要重新标记的链
+        self.dirty_chains: set[int] = set()
+        # 层数
+        self.floor = 0
+        # 这一层的种子，旧存档中没有
+        self.seed: Union[int, None] = None
+        self.colors: list[int, ...] = sim.rng.sample(range(9), 5)
+
+    def clear(self):
+        self.grid.clear()
+        self.spill.crystals.clear()
+        self.sim.events.append(('clear',))
+
+    def _rows(self):
+        """依次返回已产生的每一行的颜色和血量，包括已逐出的块"""
+        grid = self.grid
+        for k in range(grid.top // chunk_rows):
+            color, health = self.spill.read(k)
+            for row in range(chunk_rows):
+                yield color[row * grid.width:(row + 1) * grid.width], health[row * grid.width:(row + 1) * grid.width]
+        for row in range(grid.bottom - grid.top):
+            start = row * grid.width
+            yield grid.color[start:start + grid.width], grid.health[start:start + grid.width]
+
+    def spilled_crystals(self) -> list['Crystal']:
+        """已逐出的块中的水晶"""
+        return [cry for k in range(self.grid.top // chunk_rows) for cry in self.spill.crystals.get(k, ())]
+
+    def append_chunk(self, color: bytes):
+        """在最下方加入新产生的一块"""
+        health = bytes(Stone.max_health if color_ == Stone.color else 0 for color_ in color)
+        top = self.grid.bottom
+        self.grid.append(color, health)
+        self.sim.events.append(('rows', top, self.grid.bottom))
+        self.update_chain2()
+        # 停在原最下一行的水晶现在可以判定了
+        self.sim.crystals.wake_row(top - 1)
+
+    def evict_chunk(self):
+        """把最上方的一块连同其中的水晶写入spill"""
+        grid = self.grid
+        top = grid.top
+        self.sim.events.append(('evict', top))
+        color, health = grid.pop_top()
+        crystals = [cry for cry in self.sim.crystals.group if top <= cry.gird_pos[1] < grid.top]
+        for cry in crystals:
+            self.sim.crystals.remove(cry)
+        self.spill.write(top // chunk_rows, color, health, crystals)
+        self.update_chain2()
+
+    def restore_chunk(self):
+        """与evict_chunk相反，从spill读回最上方之上的一块"""
+        grid = self.grid
+        k = grid.top // chunk_rows - 1
+        color, health = self.spill.read(k)
+        grid.push_top(color, health)
+        # 砖块读回后再放入水晶，才能判定是否触地
+        for cry in self.spill.take_crystals(k):
+            self.sim.crystals.add(cry)
+        self.sim.events.append(('rows', grid.top, grid.top + chunk_rows))
+        self.update_chain2()
+
+    def load(self, data: dict, keep_top: int):
+        """
+        data['color']、data['health']为按行储存的平面，包含已产生的所有行
+        keep_top以上的块直接写入spill，与stream_floor逐出的块相同，只有其余的行放入grid并标记链
+        """
+        self.floor = data['floor']
+        self.seed = data.get('seed')
+        self.colors = list(data['colors'])
+        self.clear()
+        grid = self.grid
+        color, health = data['color'], data['health']
+        rows = len(color) // grid.width
+        size = chunk_rows * grid.width
+        # 与stream_floor相同：至少在grid中留下一块
+        spilled = max(min(keep_top // chunk_rows, (rows - 1) // chunk_rows), 0)
+        for k in range(spilled):
+            self.spill.write(k, color[k * size:(k + 1) * size], health[k * size:(k + 1) * size], [])
+        grid.top = grid.bottom = spilled * chunk_rows
+        grid.append(color[spilled * size:], health[spilled * size:])
+        self.sim.events.append(('rows', grid.top, grid.bottom))
+        self.update_chain2()
+
+    def dump(self) -> dict:
+        """与load相反，包括已逐出的块"""
+        color = bytearray()
+        health = bytearray()
+        for color_row, health_row in self._rows():
+            color += color_row
+            health += health_row
+        return {'color': bytes(color), 'health': bytes(health),
+                'floor': self.floor, 'seed': self.seed, 'colors': list(self.colors)}
+
+    # 返回指定brick的颜色，空位置或边界外为None
+    def get_brick(self, gx: int, gy: int) -> Union[int, None]:
+        return self.grid.get(gx, gy)
+
+    def has_brick(self, gx: int, gy: int) -> bool:
+        return self.grid.get(gx, gy) is not None
+
+    # 摧毁单个，无视血量。在血量<=0时或使用水晶时调用
+    def destroy_one(self, gx: int, gy: int):
+        color = self.grid.get(gx, gy)
+        if color is None:
+            return
+        self.sim.events.append(('destroy', color, gx, gy))
+        index = self.grid.index(gx, gy)
+        if self.grid.chain[index]:
+            self.dirty_chains.add(self.grid.chain[index])
+        self.grid.remove(index)
+        # 只通知停在这一格上方的水晶和玩家
+        self.sim.crystals.wake(gx, gy - 1)
+        self.sim.player.wake(gx, gy - 1)
+
+    # 摧毁石头，由destroy_brick调用
+    def destroy_stone_chain1(self, chain1: list[int]):
+        # 扣血
+        be_broken = False
+        grid = self.grid
+        for index in chain1:
+            if grid.color[index] != Stone.color:
+                continue
+            grid.health[index] -= 1
+            self.sim.events.append(('damage', *grid.pos(index)))
+            if grid.health[index] <= 0:
+                be_broken = True
+                self.destroy_one(*grid.pos(index))
+        # 播放声音
+        if be_broken:
+            self.sim.events.append(('sound', 'broken'))
+        else:
+            self.sim.events.append(('sound', 'stone'))
+
+    # 玩家摧毁方块，调用前要先判断是否为空
+    def destroy_brick(self, gx: int, gy: int):
+        index = self.grid.index(gx, gy)
+        chain1 = self.chain2[self.chain_of(gx, gy)]
+        color = self.grid.color[index]
+        if color == Stone.color:
+            self.destroy_stone_chain1(chain1)
+        else:
+            if color == 31:
+                self.sim.need_next = True
+            for index_ in chain1:
+                self.destroy_one(*self.grid.pos(index_))
+            self.sim.events.append(('sound', 'soil'))
+
+    # 返回指定brick所属的链，0代表空位置
+    def chain_of(self, gx: int, gy: int) -> int:
+        self.refresh_chains()
+        return self.grid.chain[self.grid.index(gx, gy)]
+
+    # 返回指定brick所属的链的砖块数
+    def chain_size(self, gx: int, gy: int) -> int:
+        ch_index = self.chain_of(gx, gy)
+        return len(self.chain2[ch_index]) if ch_index else 0
+
+    def _new_chain(self) -> int:
+        """分配一个空的chain1，返回其序号"""
+        if self.free_chains:
+            ch_index = self.free_chains.pop()
+            self.chain2[ch_index] = []
+        else:
+            ch_index = len(self.chain2)
+            self.chain2.append([])
+        return ch_index
+
+    def refresh_chains(self):
+        """
+        只重新标记有砖块被破坏的链。破坏不会让两条链合并，只会让一条链断开，
+        所以只需在原链剩下的砖块中重新划分
+        """
+        if not self.dirty_chains:
+            return
+        grid = self.grid
+        for ch_index in self.dirty_chains:
+            rest = [index for index in self.chain2[ch_index] if grid.chain[index] == ch_index]
+            self.chain2[ch_index] = None
+            self.free_chains.append(ch_index)
+            for index in rest:
+                grid.chain[index] = 0
+            for index in rest:
+                if not grid.chain[index]:
+                    self.update_chain1(*grid.pos(index), self._new_chain())
+        self.dirty_chains.clear()
+
+    # 通过update_chain2和refresh_chains调用，为一个chain1（不是chain2）添加所有应添加的brick，并更新这些brick的chain
+    # 用栈代替递归，大片同色区域也不会超过递归深度限制
+    def update_chain1(self, gx: int, gy: int, ch_index: int):
+        grid = self.grid
+        width = grid.width
+        size = len(grid.color)
+        chain1 = self.chain2[ch_index]
+        start = grid.index(gx, gy)
+        color = grid.color[start]
+        grid.chain[start] = ch_index
+        stack = [start]
+        while stack:
+            index = stack.pop()
+            chain1.append(index)
+            gx_ = index % width
+            # 链锁赋值判定：左、右、上、下。颜色和自己相同（空位置为EMPTY，不会相同），且没chain
+            for near, inside in ((index - 1, gx_ > 0), (index + 1, gx_ < width - 1),
+                                 (index - width, index >= width), (index + width, index + width < size)):
+                if inside and grid.color[near] == color and not grid.chain[near]:
+                    grid.chain[near] = ch_index
+                    stack.append(near)
+
+    # 重新标记内存中的整个chain2，只在产生、逐出或读取块时调用，破坏砖块后由refresh_chains更新
+    def update_chain2(self):
+        # 初始化
+        grid = self.grid
+        self.chain2 = [None]
+        self.free_chains.clear()
+        self.dirty_chains.clear()
+        grid.chain = array('I', bytes(4 * len(grid.color)))
+        for index, color in enumerate(grid.color):
+            if color == grid.EMPTY or grid.chain[index]:
+                continue
+            self.update_chain1(*grid.pos(index), self._new_chain())
+
+
+class PlayerState:
+    def __init__(self, sim: 'Simulation', gx: int, gy: int):
+        self.sim = sim
+        self.gird_pos = [gx, gy]
+        self.pos = pixel_units(self.gird_pos)
+        self.status = 'down'
+        self.health = 255
+        self.on_brick = False
+        # 换了格子或脚下砖块被破坏后才需要重新检测是否触地
+        self.need_detect = True
+        # 移动、破坏方块冷却
+        self.move_cool = 18
+        self.move_time = 2 * self.move_cool
+        self.destroy_cool = 15
+        self.destroy_time = 2 * self.destroy_cool
+        # 偏移，player相对于窗口最上顶的距离
+        self.offset = 7 * brick_len
+        # 上一步的pos和offset，绘制时插值用
+        self.last_pos = list(self.pos)
+        self.last_offset = self.offset
+        # 玩家是否到这一层底部。
+        self.at_sub = False
+        self.moving: int = 0  # 0：不动，1：左，2：右
+        self.moving_u = False
+        # 速度、下落速度，单位是每步移动像素数。
+        self.speed = 4
+        self.fall_speed = 4
+        self.off_speed = 3
+
+    def load(self, data: dict):
+        self.gird_pos = list(data['gird_pos'])
+        self.pos = list(data['pos'])
+        self.status = data['status']
+        self.health = data['health']
+        self.on_brick = data['on_brick']
+        self.need_detect = True
+        self.destroy_time = data['destroy_time']
+        self.offset = data['offset']
+        self.at_sub = data['at_sub']
+        self.moving = data['moving']
+        self.moving_u = data['moving_u']
+        self.keep_last()
+
+    def dump(self) -> dict:
+        return {
+            'gird_pos': list(self.gird_pos),
+            'pos': list(self.pos),
+            'status': self.status,
+            'health': self.health,
+            'on_brick': self.on_brick,
+            'move_time': self.move_time,
+            'destroy_time': self.destroy_time,
+            'offset': self.offset,
+            'at_sub': self.at_sub,
+            'moving': self.moving,
+            'moving_u': self.moving_u
+        }
+
+    def keep_last(self):
+        """记下这一步开始时的位置，绘制时在它与当前位置之间插值"""
+        self.last_pos = list(self.pos)
+        self.last_offset = self.offset
+
+    def camera_top(self) -> int:
+        """镜头最上方所在的行"""
+        return (self.pos[1] - self.offset) // brick_len
+
+    def destroy_begin(self):
+        self.destroy_time = self.destroy_cool
+
+    def move_begin(self):
+        self.move_time = self.move_cool
+
+    def destroy(self, status: str):
+        if self.destroy_time != 0:
+            return
+        self.destroy_begin()
+        field = self.sim.field
+        # 以下为根据player方向改变
+        if status == 'left' and field.has_brick(self.gird_pos[0] - 1, self.gird_pos[1]):
+            field.destroy_brick(self.gird_pos[0] - 1, self.gird_pos[1])
+        elif status == 'right' and field.has_brick(self.gird_pos[0] + 1, self.gird_pos[1]):
+            field.destroy_brick(self.gird_pos[0] + 1, self.gird_pos[1])
+        elif status == 'up' and field.has_brick(self.gird_pos[0], self.gird_pos[1] - 1):
+            field.destroy_brick(self.gird_pos[0], self.gird_pos[1] - 1)
+        elif status == 'down' and field.has_brick(self.gird_pos[0], self.gird_pos[1] + 1):
+            field.destroy_brick(self.gird_pos[0], self.gird_pos[1] + 1)
+        else:
+            return
+        self.health -= 1
+
+    def input(self, keys: int):
+        if keys & KEY_SPACE:
+            self.destroy(self.status)
+        if keys & KEY_UP:
+            self.status = 'up'
+        elif keys & KEY_DOWN:
+            self.status = 'down'
+        if keys & KEY_LEFT:
+            self.decide_move_left()
+        elif keys & KEY_RIGHT:
+            self.decide_move_right()
+
+    def wake(self, gx: int, gy: int):
+        """(gx, gy)下方的砖块被破坏，站在这一格时需要重新检测"""
+        if self.gird_pos == [gx, gy]:
+            self.need_detect = True
+
+    # 是否触地的检测，由fall调用
+    def _detect_on_break(self):
+        if self.moving_u:
+            self.on_brick = True
+        elif self.need_detect:
+            self.need_detect = False
+            self.on_brick = self.sim.field.has_brick(self.gird_pos[0], self.gird_pos[1] + 1)
+
+    # 落入下一格，由fall调用
+    def _fall_next(self):
+        if not self.on_brick:
+            if self.pos[1] < (self.gird_pos[1] + 1) * brick_len:
+                self.pos[1] += self.fall_speed
+            else:
+                self.gird_pos[1] += 1
+                self.pos[1] = self.gird_pos[1] * brick_len
+                self.need_detect = True
+
+    def fall(self):
+        self._detect_on_break()
+        self._fall_next()
+
+    # 向右向移动决定，由input调用
+    def decide_move_right(self):
+        self.status = 'right'
+        field = self.sim.field
+        if self.move_time == 0 and self.gird_pos[0] < world_size[0] - 1 and self.on_brick:
+            if not field.has_brick(self.gird_pos[0] + 1, self.gird_pos[1]):
+                self.moving = 2
+            elif not field.has_brick(self.gird_pos[0] + 1, self.gird_pos[1] - 1) \
+                    and not field.has_brick(self.gird_pos[0], self.gird_pos[1] - 1):
+                self.moving = 2
+                self.moving_u = True
+            self.move_begin()
+
+    # 向左方向移动决定，由input调用
+    def decide_move_left(self):
+        self.status = 'left'
+        field = self.sim.field
+        if self.move_time == 0 and self.gird_pos[0] > 0 and self.on_brick:
+            if not field.has_brick(self.gird_pos[0] - 1, self.gird_pos[1]):
+                self.moving = 1
+            elif not field.has_brick(self.gird_pos[0] - 1, self.gird_pos[1] - 1) \
+                    and not field.has_brick(self.gird_pos[0], self.gird_pos[1] - 1):
+                self.moving = 1
+                self.moving_u = True
+            self.move_begin()
+
+    # 向右移动，由move调用
+    def move_right(self):
+        if self.pos[0] < (self.gird_pos[0] + 1) * brick_len:
+            self.pos[0] += self.speed
+        else:
+            self.moving = 0
+            self.gird_pos[0] += 1
+            self.pos[0] = self.gird_pos[0] * brick_len
+            self.need_detect = True
+
+    # 向左移动，由move调用
+    def move_left(self):
+        if self.pos[0] > (self.gird_pos[0] - 1) * brick_len:
+            self.pos[0] -= self.speed
+        else:
+            self.moving = 0
+            self.gird_pos[0] -= 1
+            self.pos[0] = self.gird_pos[0] * brick_len
+            self.need_detect = True
+
+    # 向上移动，由move调用
+    def move_up(self):
+        if self.pos[1] > (self.gird_pos[1] - 1) * brick_len:
+            self.pos[1] -= self.speed
+        else:
+            self.moving_u = False
+            self.gird_pos[1] -= 1
+            self.pos[1] = self.gird_pos[1] * brick_len
+            self.need_detect = True
+
+    def move(self):
+        if self.moving == 2:
+            self.move_right()
+        elif self.moving == 1:
+            self.move_left()
+        if self.moving_u:
+            self.move_up()
+
+    def set_offset(self):
+        # 镜头到达这一层底部时，镜头最上方所在的行
+        bottom_top = world_size[1] - screen_rows
+        if self.at_sub:
+            # 2 状态
+            if self.gird_pos[1] >= bottom_top + 7:
+                self.offset = max(self.pos[1] - bottom_top * brick_len, 7 * brick_len)
+            # 2 -> 1 状态
+            elif self.offset > 7 * brick_len:
+                self.offset -= self.off_speed
+            else:
+                # 正式进入 1
+                self.at_sub = False
+                self.offset = 7 * brick_len
+        # 1 -> 2
+        elif self.gird_pos[1] >= bottom_top + 7:
+            self.at_sub = True
+
+    def cooling_down(self):
+        self.move_time -= 1
+        self.move_time = max(self.move_time, 0)
+        self.destroy_time -= 1
+        self.destroy_time = max(self.destroy_time, 0)
+
+    def update(self):
+        self.fall()
+        self.move()
+        self.set_offset()
+        self.cooling_down()
+
+
+class Crystal:
+    def __init__(self, color: int, gird_pos: list[int, int]):
+        self.color = color
+        self.gird_pos: list[int, int] = gird_pos
+        self.pos = pixel_units(self.gird_pos)
+        # 上一步的pos，绘制时插值用
+        self.last_pos = list(self.pos)
+        self.on_brick = True
+        self.fall_speed = 4
+
+    def dump(self) -> dict:
+        return {'color': self.color, 'gird_pos': list(self.gird_pos), 'pos': list(self.pos), 'on_brick': self.on_brick}
+
+    # 下落，进入下一格后由CrystalSet重新判定
+    def fall(self) -> bool:
+        """返回是否进入了下一格"""
+        if self.pos[1] < (self.gird_pos[1] + 1) * brick_len:
+            self.pos[1] += self.fall_speed
+            return False
+        self.gird_pos[1] += 1
+        self.pos[1] = self.gird_pos[1] * brick_len
+        return True
+
+
+class CrystalSet:
+    """场地上的水晶。静止的水晶按所在格子索引，只有下落中的水晶需要每步更新"""
+
+    def __init__(self, sim: 'Simulation'):
+        self.sim = sim
+        self.group: list['Crystal'] = []
+        self.resting: dict[Tuple[int, int], list['Crystal']] = {}
+        self.falling: list['Crystal'] = []
+        # 水晶增减时加一
+        self.revision = 0
+
+    def clear(self):
+        self.revision += 1
+        self.group.clear()
+        self.resting.clear()
+        self.falling.clear()
+
+    def load(self, data: list[dict]):
+        """在Field.load之后调用，已写入spill的块中的水晶放入spill"""
+        self.clear()
+        field = self.sim.field
+        for data_ in data:
+            cry = Crystal(data_['color'], list(data_['gird_pos']))
+            cry.pos = list(data_['pos'])
+            cry.last_pos = list(cry.pos)
+            if cry.gird_pos[1] < field.grid.top:
+                cry.on_brick = data_['on_brick']
+                field.spill.crystals.setdefault(cry.gird_pos[1] // chunk_rows, []).append(cry)
+            else:
+                # on_brick按砖块重新判定
+                self.add(cry)
+
+    def dump(self) -> list[dict]:
+        """包括已逐出的块中的水晶"""
+        return [cry.dump() for cry in itertools.chain(self.group, self.sim.field.spilled_crystals())]
+
+    def add(self, cry: 'Crystal'):
+        self.revision += 1
+        self.group.append(cry)
+        self.settle(cry)
+
+    def remove(self, cry: 'Crystal'):
+        self.revision += 1
+        self.group.remove(cry)
+        if cry.on_brick:
+            cell = tuple(cry.gird_pos)
+            self.resting[cell].remove(cry)
+            if not self.resting[cell]:
+                del self.resting[cell]
+        else:
+            self.falling.remove(cry)
+
+    def settle(self, cry: 'Crystal'):
+        """判定水晶是否触地，放入resting或falling。下方还未产生的行视为触地，产生时再由wake_row判定"""
+        gx, gy = cry.gird_pos
+        grid = self.sim.field.grid
+        cry.on_brick = not grid.top <= gy + 1 < grid.bottom or grid.get(gx, gy + 1) is not None
+        if cry.on_brick:
+            # 静止后不再更新last_pos，直接停在当前位置
+            cry.last_pos = list(cry.pos)
+            if cry in self.falling:
+                self.falling.remove(cry)
+            self.resting.setdefault((gx, gy), []).append(cry)
+        elif cry not in self.falling:
+            self.falling.append(cry)
+
+    def wake(self, gx: int, gy: int):
+        """(gx, gy)下方的砖块被破坏，重新判定停在这一格的水晶"""
+        for cry in self.resting.pop((gx, gy), []):
+            self.settle(cry)
+
+    def wake_row(self, gy: int):
+        """gy下方产生了新的一行，重新判定停在这一行的水晶"""
+        for gx in range(world_size[0]):
+            self.wake(gx, gy)
+
+    def eat(self, gird_pos: list[int, int]):
+        """玩家吸收所在格子的水晶"""
+        bag = self.sim.bag
+        eaten = self.resting.get(tuple(gird_pos), []) + [cry for cry in self.falling if cry.gird_pos == gird_pos]
+        for cry in eaten:
+            # 背包未满
+            if bag.full():
+                break
+            # 向背包里添加水晶
+            bag.add_crystal(cry.color, 1)
+            # 移除场地的水晶
+            self.remove(cry)
+            self.sim.events.append(('sound', 'crystal_get'))
+
+    def keep_last(self):
+        """记下下落中的水晶这一步开始时的位置"""
+        for cry in self.falling:
+            cry.last_pos = list(cry.pos)
+
+    def update(self):
+        self.eat(self.sim.player.gird_pos)
+        for cry in list(self.falling):
+            if cry.fall():
+                self.settle(cry)
+
+
+class Bag:
+    """背包中每种颜色水晶的数量"""
+
+    def __init__(self, sim: 'Simulation'):
+        self.sim = sim
+        self.nums: list[int] = [1] * 9
+        self.max_value = 32
+
+    def load(self, data: list[int]):
+        self.nums[:len(data)] = data
+
+    def dump(self) -> list[int]:
+        return list(self.nums)
+
+    def full(self) -> bool:
+        return sum(self.nums) >= self.max_value
+
+    def add_crystal(self, color: int, number: int):
+        self.nums[color] += number
+
+    # 用水晶破坏玩家上下7行内同色的砖块
+    def crystal_destroy(self, color: int):
+        field = self.sim.field
+        gy = self.sim.player.gird_pos[1]
+        have_brick = False
+        for x, y in itertools.product(range(world_size[0]), range(-7, 8)):
+            # 空位置和边界外都为None，不会与水晶颜色相同
+            if field.get_brick(x, gy + y) == color:
+                have_brick = True
+                field.destroy_one(x, gy + y)
+        if have_brick:
+            self.sim.events.append(('sound', 'broken' if color == Stone.color else 'soil'))
+
+    # 使用水晶
+    def magic(self, color: int):
+        if self.nums[color] <= 0:
+            return
+        self.nums[color] -= 1
+        self.crystal_destroy(color)
+
+
+class Simulation:
+    """
+    一局游戏的全部状态。每一步由step(keys)前进，keys为按住的键和命令（KEY_*）
+    同样的种子和同样的输入总会得到同样的结果
+    """
+
+    def __init__(self, seed: Union[int, None] = None, planner: Union[Executor, None] = None):
+        self.seed = Random().getrandbits(64) if seed is None else seed
+        self.rng = Random(self.seed)
+        # 这一步发生的事：绘制、声音据此更新，每步开始时清空
+        self.events: list[tuple] = []
+        self.field = Field(self)
+        self.crystals = CrystalSet(self)
+        self.bag = Bag(self)
+        self.player = PlayerState(self, self.rng.randint(0, world_size[0] - 1), -1)
+        # 继续产生这一层的块所用的产生器
+        self.floor_gen: Union['FloorGenerator', None] = None
+        # 有planner时在后台预先产生下一层，没有时换层时再产生
+        self.planner = planner
+        self.next_seed = self.rng.getrandbits(64)
+        self.next_plan: Union[Future, None] = None
+        self._submit_plan()
+        self.need_next = False
+        self.steps = 0
+        # 录制时记下每一步的keys
+        self.recording: Union['Recording', None] = None
+
+    def _submit_plan(self):
+        if self.planner is not None:
+            self.next_plan = self.planner.submit(FloorPlan, self.next_seed)
+
+    def _take_plan(self) -> 'FloorPlan':
+        """取出下一层，并开始产生再下一层"""
+        plan = self.next_plan.result() if self.next_plan is not None else FloorPlan(self.next_seed)
+        self.next_seed = self.rng.getrandbits(64)
+        self._submit_plan()
+        return plan
+
+    def close(self):
+        self.field.spill.close()
+
+    def start(self):
+        """新的一局：换上第一层"""
+        self.set_floor()
+
+    def load(self, archive: dict):
+        self.player.load(archive['player'])
+        self.field.load(archive['bricks'], self._keep_top())
+        self.crystals.load(archive['crystals'])
+        self.bag.load(archive['backpack'])
+        if self.field.seed is None:
+            self.field.seed = self.rng.getrandbits(64)
+        self.floor_gen = FloorGenerator(self.field.seed, self.field.colors)
+        self.stream_floor()
+
+    def dump(self) -> dict:
+        return {
+            'player': self.player.dump(),
+            'bricks': self.field.dump(),
+            'crystals': self.crystals.dump(),
+            'backpack': self.bag.dump()
+        }
+
+    def _append_chunk(self):
+        """在已产生的块下方产生一块砖块，水晶"""
+        grid = self.field.grid
+        color, crystals = self.floor_gen.chunk(grid.bottom, grid.next_rows())
+        # 设定chain
+        self.field.append_chunk(color)
+        # 砖块就位后再放入水晶
+        for cry_color, gird_pos in crystals:
+            self.crystals.add(Crystal(cry_color, gird_pos))
+
+    def _keep_top(self) -> int:
+        """镜头上方保留的最上一行，再往上的块逐出"""
+        return self.player.camera_top() - chunk_keep * chunk_rows
+
+    def stream_floor(self):
+        """以镜头为准，在下方预先产生块，逐出上方较远的块，镜头回到上方时读回"""
+        grid = self.field.grid
+        camera_top = self.player.camera_top()
+        keep_top = self._keep_top()
+        while grid.bottom < min(camera_top + screen_rows + chunk_ahead * chunk_rows, grid.depth):
+            self._append_chunk()
+        while grid.top + chunk_rows <= keep_top and grid.bottom - grid.top > chunk_rows:
+            self.field.evict_chunk()
+        while grid.top > max(keep_top, 0):
+            self.field.restore_chunk()
+
+    def set_floor(self):
+        """换上预先产生的一层。其余的块由stream_floor随镜头产生"""
+        plan = self._take_plan()
+        self.floor_gen = plan.generator
+        self.field.seed = plan.generator.seed
+        self.field.colors = plan.generator.colors
+        self.field.floor += 1
+        self.field.clear()
+        self.crystals.clear()
+        for color, crystals in plan.chunks:
+            self.field.append_chunk(color)
+            for cry_color, gird_pos in crystals:
+                self.crystals.add(Crystal(cry_color, gird_pos))
+        self.stream_floor()
+
+    def next_floor(self):
+        """生成下一层"""
+        self.need_next = False
+        self.events.append(('next_floor',))
+        # 改变玩家位置，换层是瞬移，不插值
+        self.player.gird_pos[1] = -6
+        self.player.pos = pixel_units(self.player.gird_pos)
+        self.player.need_detect = True
+        self.player.keep_last()
+        self.set_floor()
+
+    def depth(self) -> int:
+        """从第一层算起的深度，即DP"""
+        return (self.field.floor - 1) * world_size[1] + self.player.gird_pos[1] + 1
+
+    def hold(self):
+        """不前进的一步（暂停等）：只记下位置，绘制时不插值"""
+        self.player.keep_last()
+        self.crystals.keep_last()
+
+    def step(self, keys: int = 0):
+        """前进一步"""
+        self.events.clear()
+        self.steps += 1
+        if self.recording is not None:
+            self.recording.record(keys)
+        self.hold()
+        if keys & KEY_MOVE_COOL:
+            self.player.move_begin()
+        if keys & KEY_DESTROY_COOL:
+            self.player.destroy_begin()
+        if keys >> KEY_CRYSTAL_SHIFT:
+            self.bag.magic((keys >> KEY_CRYSTAL_SHIFT) - 1)
+        self.player.input(keys)
+        self.crystals.update()
+        self.player.update()
+        self.stream_floor()
+        if self.need_next:
+            self.next_floor()
+
+    def summary(self) -> dict:
+        return {'seed': self.seed, 'steps': self.steps, 'floor': self.field.floor, 'depth': self.depth(),
+                'health': self.player.health, 'crystals': sum(self.bag.nums)}
+
+
+class Archive:
+    """
+    存档的二进制格式，与Simulation.dump（加上main.py中的碎片和关卡状态）得到的字典互相转换
+    格式：magic，版本，标志（有没有这一局，有没有关卡状态），关卡状态，层数、种子、颜色、
+    按行储存的颜色和血量平面，玩家，之后是水晶、背包、碎片，各为数量加上定长的记录，都是小端
+    """
+    magic = b'CASV'
+    version = 1
+    HAS_GAME = 1
+    HAS_STATUS = 2
+    statuses = ('up', 'down', 'left', 'right')
+    header = struct.Struct('<4sHBB')
+    # 层数，种子，有没有种子，颜色数，宽度，行数
+    floor_record = struct.Struct('<IQBBHI')
+    # gird_pos，pos，status，health，on_brick，move_time，destroy_time，offset，at_sub，moving，moving_u
+    player_record = struct.Struct('<4iBiBiiiBBB')
+    # 颜色，on_brick，gird_pos，pos
+    crystal_record = struct.Struct('<BB4i')
+    # 颜色，pos，speed，vertical_speed，stepx，stepy
+    fragment_record = struct.Struct('<B6i')
+    count = struct.Struct('<I')
+
+    @classmethod
+    def pack(cls, archive: dict) -> bytes:
+        if not archive:
+            return cls.header.pack(cls.magic, cls.version, 0, 0)
+        flags = cls.HAS_GAME | (cls.HAS_STATUS if 'level_status' in archive else 0)
+        parts = [cls.header.pack(cls.magic, cls.version, flags, archive.get('level_status', 0))]
+        bricks = archive['bricks']
+        seed = bricks.get('seed')
+        parts.append(cls.floor_record.pack(bricks['floor'], seed or 0, seed is not None, len(bricks['colors']),
+                                           world_size[0], len(bricks['color']) // world_size[0]))
+        parts += bytes(bricks['colors']), bytes(bricks['color']), bytes(bricks['health'])
+        player = archive['player']
+        parts.append(cls.player_record.pack(*player['gird_pos'], *player['pos'], cls.statuses.index(player['status']),
+                                            player['health'], player['on_brick'], player['move_time'],
+                                            player['destroy_time'], player['offset'], player['at_sub'],
+                                            player['moving'], player['moving_u']))
+        crystals = archive['crystals']
+        parts.append(cls.count.pack(len(crystals)))
+        parts += (cls.crystal_record.pack(cry['color'], cry['on_brick'], *cry['gird_pos'], *cry['pos'])
+                  for cry in crystals)
+        nums = archive['backpack']
+        parts.append(cls.count.pack(len(nums)) + struct.pack(f'<{len(nums)}i', *nums))
+        fragments = archive.get('fragments', [])
+        parts.append(cls.count.pack(len(fragments)))
+        parts += (cls.fragment_record.pack(fra['color'], *fra['pos'], fra['speed'], fra['vertical_speed'],
+                                           fra['stepx'], fra['stepy']) for fra in fragments)
+        return b''.join(parts)
+
+    @classmethod
+    def _records(cls, record: struct.Struct, data: bytes, pos: int) -> Tuple[list[tuple], int]:
+        """读取数量和之后的定长记录，返回记录和之后的位置"""
+        (count,) = cls.count.unpack_from(data, pos)
+        pos += cls.count.size
+        end = pos + count * record.size
+        return list(record.iter_unpack(data[pos:end])), end
+
+    @classmethod
+    def unpack(cls, data: bytes) -> dict:
+        magic, version, flags, level_status = cls.header.unpack_from(data, 0)
+        if magic != cls.magic:
+            raise ValueError('不是存档')
+        if version != cls.version:
+            raise ValueError(f'存档的版本为{version}，无法读取')
+        if not flags & cls.HAS_GAME:
+            return {}
+        pos = cls.header.size
+        floor, seed, has_seed, color_num, width, rows = cls.floor_record.unpack_from(data, pos)
+        if width != world_size[0]:
+            raise ValueError(f'存档的宽度为{width}，与world_size不同')
+        pos += cls.floor_record.size
+        size = width * rows
+        bricks = {'floor': floor, 'seed': seed if has_seed else None, 'colors': list(data[pos:pos + color_num]),
+                  'color': data[pos + color_num:pos + color_num + size],
+                  'health': data[pos + color_num + size:pos + color_num + 2 * size]}
+        pos += color_num + 2 * size
+        gx, gy, x, y, status, health, on_brick, move_time, destroy_time, offset, at_sub, moving, moving_u = \
+            cls.player_record.unpack_from(data, pos)
+        player = {'gird_pos': [gx, gy], 'pos': [x, y], 'status': cls.statuses[status], 'health': health,
+                  'on_brick': bool(on_brick), 'move_time': move_time, 'destroy_time': destroy_time, 'offset': offset,
+                  'at_sub': bool(at_sub), 'moving': moving, 'moving_u': bool(moving_u)}
+        pos += cls.player_record.size
+        records, pos = cls._records(cls.crystal_record, data, pos)
+        crystals = [{'color': color, 'gird_pos': [gx, gy], 'pos': [x, y], 'on_brick': bool(on_brick)}
+                    for color, on_brick, gx, gy, x, y in records]
+        (count,) = cls.count.unpack_from(data, pos)
+        backpack = list(struct.unpack_from(f'<{count}i', data, pos + cls.count.size))
+        pos += cls.count.size + 4 * count
+        records, pos = cls._records(cls.fragment_record, data, pos)
+        fragments = [{'color': color, 'pos': [x, y], 'speed': speed, 'vertical_speed': vertical_speed,
+                      'stepx': stepx, 'stepy': stepy} for color, x, y, speed, vertical_speed, stepx, stepy in records]
+        archive = {'player': player, 'bricks': bricks, 'crystals': crystals, 'backpack': backpack,
+                   'fragments': fragments}
+        if flags & cls.HAS_STATUS:
+            archive['level_status'] = level_status
+        return archive
+
+    @staticmethod
+    def migrate(archive: dict) -> dict:
+        """
+        把旧的json存档换成与unpack相同的字典：
+        b_list2（b_list2[gx][gy]为None、颜色或[颜色, 血量]）换成按行储存的平面
+        """
+        if not archive or 'b_list2' not in archive['bricks']:
+            return archive
+        archive = dict(archive)
+        bricks = archive['bricks'] = dict(archive['bricks'])
+        b_list2_ = bricks.pop('b_list2')
+        width = world_size[0]
+        rows = len(b_list2_[0]) if b_list2_ else 0
+        color = bytearray([BrickGrid.EMPTY]) * (rows * width)
+        health = bytearray(rows * width)
+        for gx, list1_ in enumerate(b_list2_):
+            for gy, brick_ in enumerate(list1_):
+                if type(brick_) == int:
+                    color[gy * width + gx] = brick_
+                    if brick_ == Stone.color:
+                        health[gy * width + gx] = Stone.max_health
+                elif type(brick_) in (list, tuple):
+                    color[gy * width + gx] = brick_[0]
+                    health[gy * width + gx] = brick_[1]
+        bricks['color'] = bytes(color)
+        bricks['health'] = bytes(health)
+        return archive
+
+
+class Recording:
+    """
+    一局的种子、开始时的存档和每一步交给Simulation.step的keys，用同样的种子重放可以得到完全相同的一局
+    格式：magic，版本，种子，存档长度，存档（Archive，新的一局时为空），之后是小端的uint16对（keys, 连续的步数）
+    版本1的存档为json
+    """
+    magic = b'CARP'
+    version = 2
+    max_run = 0xFFFF
+
+    def __init__(self, seed: int, archive: Union[dict, None] = None):
+        self.seed = seed
+        self.archive = archive or None
+        # 连续相同的keys只记一次：keys, 步数, keys, 步数...
+        self.runs = array('H')
+        self.steps = 0
+
+    def record(self, keys: int):
+        runs = self.runs
+        if runs and runs[-2] == keys and runs[-1] < self.__class__.max_run:
+            runs[-1] += 1
+        else:
+            runs.extend((keys, 1))
+        self.steps += 1
+
+    def __iter__(self):
+        """逐步给出keys"""
+        runs = self.runs
+        for i in range(0, len(runs), 2):
+            yield from itertools.repeat(runs[i], runs[i + 1])
+
+    def save(self, path: str):
+        archive = Archive.pack(self.archive) if self.archive else b''
+        runs = array('H', self.runs)
+        if sys.byteorder == 'big':
+            runs.byteswap()
+        with open(path, 'wb') as f:
+            f.write(self.__class__.magic + struct.pack('<HQI', self.__class__.version, self.seed, len(archive)))
+            f.write(archive)
+            f.write(runs.tobytes())
+
+    @classmethod
+    def load(cls, path: str) -> 'Recording':
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:4] != cls.magic:
+            raise ValueError(f'{path} 不是录像')
+        version, seed, length = struct.unpack_from('<HQI', data, 4)
+        if version not in (1, cls.version):
+            raise ValueError(f'{path} 的版本为{version}，无法重放')
+        pos = 18 + length
+        if not length:
+            archive = None
+        elif version == 1:
+            archive = Archive.migrate(json.loads(data[18:pos]))
+        else:
+            archive = Archive.unpack(data[18:pos])
+        recording = cls(seed, archive)
+        recording.runs.frombytes(data[pos:])
+        if sys.byteorder == 'big':
+            recording.runs.byteswap()
+        recording.steps = sum(recording.runs[1::2])
+        return recording
+
+    def simulation(self, planner: Union[Executor, None] = None) -> Simulation:
+        """与录制开始时相同的Simulation"""
+        sim = Simulation(self.seed, planner)
+        if self.archive:
+            sim.load(self.archive)
+        else:
+            sim.start()
+        return sim
+
+    def replay(self) -> dict:
+        """无界面地尽快重放，返回结果"""
+        sim = self.simulation()
+        try:
+            for keys in self:
+                sim.step(keys)
+            return sim.summary()
+        finally:
+            sim.close()
+
+
+def dig_down(sim: Simulation) -> int:
+    """最简单的策略：一直向下挖"""
+    return KEY_DOWN | KEY_SPACE
+
+
+def play(seed: int, steps: int, policy: Callable[[Simulation], int] = dig_down) -> dict:
+    """无界面地模拟一局，返回结果"""
+    sim = Simulation(seed)
+    try:
+        sim.start()
+        for _ in range(steps):
+            sim.step(policy(sim))
+        return sim.summary()
+    finally:
+        sim.close()
+
+
+def play_many(seeds, steps: int, policy: Callable[[Simulation], int] = dig_down,
+              workers: Union[int, None] = None) -> list[dict]:
+    """在进程池中同时模拟多局，policy必须是模块中的函数，才能传给子进程"""
+    seeds = list(seeds)
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(play, seeds, itertools.repeat(steps), itertools.repeat(policy),
+                             chunksize=max(len(seeds) // (4 * workers), 1)))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['replay']:
+        # python core.py replay 录像文件
+        print(Recording.load(sys.argv[2]).replay())
+        sys.exit()
+    # python core.py [局数] [每局步数]
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    steps_ = int(sys.argv[2]) if len(sys.argv) > 2 else 3600
+    for result in play_many(range(runs), steps_):
+        print(result)
@@ -1,66 +1,271 @@
+import io
 import itertools
 import os
 import json
+import mmap
+import struct
 import sys
+import tempfile
+import time
+import tracemalloc
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
 from random import randint
-from random import sample, choice
-from typing import Tuple, Union
+from random import sample, choice, seed
+from typing import Callable, Iterator, Tuple, Union
 
 import pygame
 
-screen_size = (400, 600)
+from core import brick_len, screen_size, world_size, sub_rows, chunk_rows
+from core import KEY_SPACE, KEY_UP, KEY_DOWN, KEY_LEFT, KEY_RIGHT, KEY_MOVE_COOL, KEY_DESTROY_COOL, KEY_CRYSTAL_SHIFT
+from core import BrickGrid, Stone, Field, PlayerState, CrystalSet, Bag, Simulation, Archive, Recording
+
+# 与玩法有关的设置（窗口大小、格子边长、每层的大小等）在core.py中
 full_size = (500, 750)
 display_size = (1600, 900)
 triple_size = (1280, 720)  # 显示器尺寸的80%
-brick_len = 40
+# 每秒模拟的步数，所有以帧计的时间（冷却、速度等）都是指模拟步
 FPS = 60
+# 绘制的帧率上限，与模拟步数无关，绘制时在两步之间插值
+render_fps = 144
+# 一帧最多追赶的模拟步数，卡顿超过这个时间就丢弃，不再追赶
+max_steps = 8
+# 屏保时的绘制帧率，模拟仍为每秒FPS步，移动速度不变
+IDLE_FPS = 15
+# 关卡中按住的键，每一步交给Simulation
+key_bits = {pygame.K_SPACE: KEY_SPACE, pygame.K_UP: KEY_UP, pygame.K_DOWN: KEY_DOWN,
+            pygame.K_LEFT: KEY_LEFT, pygame.K_RIGHT: KEY_RIGHT}
+
+
+# 按颜色排列的文件名，与砖块、水晶的颜色序号一致
+color_names = ('red', 'yellow', 'green', 'blue', 'purple', 'orange', 'pink', 'indigo')
+# 图片清单：名称 -> 文件，或按颜色排列的一组文件
+image_files: dict[str, Union[str, Tuple[str, ...]]] = {
+    'background': 'image/background.png',
+    'backpack': 'image/backpack.png',
+    'arrow': 'image/arrow.png',
+    **{f'player/{name}': f'image/player/{name}.png' for name in ('up', 'down', 'left', 'right', 'player')},
+    'brick/soil': tuple(f'image/brick/{name}.png' for name in color_names),
+    'brick/sub': 'image/brick/sub_brick.png',
+    'brick/stone': tuple(f'image/brick/stone/Stone5-{health}.png' for health in range(1, 6)),
+    'fragment': tuple(f'image/fragment/{name}.png' for name in color_names) + ('image/fragment/stone_five.png',),
+    'crystal': tuple(f'image/crystal/Crystal{name.capitalize()}.png' for name in color_names)
+    + ('image/crystal/Crystal_stone_five.png',),
+    'map/brick': tuple(f'image/map/brick/{name}.png' for name in color_names + ('stone',)),
+    'map/crystal': tuple(f'image/map/crystal/{name}.png' for name in color_names + ('stone',)),
+    **{f'pause/{name}': f'image/pause/{name}.png' for name in ('background', 'back', 'bag', 'menu')},
+    **{f'menu/{name}': f'image/menu/{name}.png' for name in ('old_play', 'new_play', 'quit', 'arrow', 'player_l')},
+    'menu/logos/bg': 'image/menu/logos/bg.png',
+    **{f'menu/logos/{path}{color}': f'image/menu/logos/{path}{color}.png'
+       for path in ('0/', '1/', '2/', '3/', '4/') for color in range(8)}
+}
+# 已读取的图片
+_assets: dict[str, Union[pygame.Surface, Tuple[pygame.Surface, ...]]] = {}
+# 资源包的文件名，由 python main.py pack 产生
+bundle_path = 'assets.bundle'
+
+
+class AssetBundle:
+    """
+    把image和sound下用到的文件打包成一个文件，避免逐个打开小文件
+    格式：magic，版本，文件数，索引（路径长度，路径，偏移，大小），之后是各文件的原始内容
+    """
+    magic = b'CABN'
+    version = 1
+    _instance: Union['AssetBundle', None] = None
 
+    @classmethod
+    def get_inst(cls) -> Union['AssetBundle', None]:
+        """资源包不存在时返回None，此时直接读取原文件"""
+        if cls._instance is None and os.path.exists(bundle_path):
+            cls._instance = cls(bundle_path)
+        return cls._instance
 
-def get_asset(path=None):
-    if path is None:
-        asset = {
-            'player': {
-                'image': {
-                    'up': pygame.image.load('image/player/up.png'),
-                    'down': pygame.image.load('image/player/down.png'),
-                    'left': pygame.image.load('image/player/left.png'),
-                    'right': pygame.image.load('image/player/right.png')
-                }
-            },
-            'brick': {
-                'soil': {},
-                'stone': {}
-            }
-        }
-        ...
-
-
-def pixel_units(gird_pos: list[int, int]) -> list[int, int]:
-    """将gird_pos（格子位置）换算成pos（像素位置）"""
-    x = gird_pos[0] * brick_len
-    y = gird_pos[1] * brick_len
-    return [x, y]
-
-
-def play_sound(sound: Tuple[pygame.mixer.Sound, ...]) -> None:
+    @classmethod
+    def pack(cls, path: str = bundle_path):
+        """打包两个清单中的所有文件"""
+        files = []
+        for files_ in itertools.chain(image_files.values(), (paths for paths, _ in sound_files.values())):
+            files.extend([files_] if type(files_) == str else files_)
+        files = list(dict.fromkeys(files))
+        contents = []
+        for file in files:
+            with open(file, 'rb') as f:
+                contents.append(f.read())
+        names = [file.encode('utf-8') for file in files]
+        offset = 10 + sum(18 + len(name) for name in names)
+        with open(path, 'wb') as f:
+            f.write(cls.magic + struct.pack('<HI', cls.version, len(files)))
+            for name, content in zip(names, contents):
+                f.write(struct.pack('<H', len(name)) + name + struct.pack('<QQ', offset, len(content)))
+                offset += len(content)
+            for content in contents:
+                f.write(content)
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:4] != self.__class__.magic:
+            raise ValueError(f'{path} 不是资源包')
+        version, count = struct.unpack_from('<HI', self.map, 4)
+        if version != self.__class__.version:
+            raise ValueError(f'{path} 的版本为{version}，需要重新打包')
+        # 路径 -> (偏移, 大小)
+        self.index: dict[str, Tuple[int, int]] = {}
+        pos = 10
+        for _ in range(count):
+            (length,) = struct.unpack_from('<H', self.map, pos)
+            name = self.map[pos + 2:pos + 2 + length].decode('utf-8')
+            self.index[name] = struct.unpack_from('<QQ', self.map, pos + 2 + length)
+            pos += 18 + length
+
+    def open(self, path: str) -> Union[io.BytesIO, None]:
+        if path not in self.index:
+            return None
+        offset, size = self.index[path]
+        return io.BytesIO(self.map[offset:offset + size])
+
+
+def open_asset(path: str) -> Union[io.BytesIO, str]:
+    """有资源包时从资源包中取出文件，否则返回原路径"""
+    bundle = AssetBundle.get_inst()
+    file = bundle.open(path) if bundle else None
+    return path if file is None else file
+
+
+def load_image(path: str) -> pygame.Surface:
+    return pygame.image.load(open_asset(path), path)
+
+
+def get_asset(name: str) -> Union[pygame.Surface, Tuple[pygame.Surface, ...]]:
+    """按图片清单读取原图，只在第一次用到时读取，显示前还要经过convert_image"""
+    if name not in _assets:
+        files = image_files[name]
+        _assets[name] = load_image(files) if type(files) == str else tuple(map(load_image, files))
+    return _assets[name]
+
+
+# 转换过格式的图片，键为(原图, 是否保留透明通道, 整体透明度)
+_converted: dict[Tuple[pygame.Surface, bool, int], pygame.Surface] = {}
+
+
+def convert_image(image: pygame.Surface, alpha: bool = False, opacity: int = 255) -> pygame.Surface:
+    """
+    返回原图转换为显示格式后的图片，必须在设置窗口之后调用
+    每张图只转换一次，由所有对象共用，所以不要修改返回的图片
+    """
+    key = (image, alpha, opacity)
+    if key not in _converted:
+        converted = image.convert_alpha() if alpha else image.convert()
+        if opacity < 255:
+            converted.set_alpha(opacity)
+        _converted[key] = converted
+    return _converted[key]
+
+
+# 已创建的字体，键为(字体名, 大小)。SysFont要查找系统字体，很慢
+_fonts: dict[Tuple[str, int], pygame.font.Font] = {}
+
+
+def get_font(name: str, size: int) -> pygame.font.Font:
+    """每种字体只创建一次，由所有对象共用"""
+    key = (name, size)
+    if key not in _fonts:
+        _fonts[key] = pygame.font.SysFont(name, size)
+    return _fonts[key]
+
+
+# 渲染好的文字，键为(字体, 文字, 颜色)，超过text_cache_size时丢弃最久没用到的
+text_cache_size = 256
+_texts: dict[tuple, pygame.Surface] = {}
+
+
+def render_text(font: pygame.font.Font, text: str, color) -> pygame.Surface:
+    """同样的文字只渲染一次，不要修改返回的图片"""
+    key = (font, text, color)
+    image = _texts.pop(key, None)
+    if image is None:
+        image = font.render(text, True, color)
+        if len(_texts) >= text_cache_size:
+            del _texts[next(iter(_texts))]
+    # 重新放到最后，表示最近用过
+    _texts[key] = image
+    return image
+
+
+# 音效包：名称 -> (文件, 音量)
+sound_files: dict[str, Tuple[Tuple[str, ...], float]] = {
+    'soil': (('sound/soil/01.wav', 'sound/soil/02.wav', 'sound/soil/03.wav', 'sound/soil/04.wav'), 0.3),
+    'stone': (('sound/stone/01.wav', 'sound/stone/02.wav', 'sound/stone/03.wav', 'sound/stone/04.wav'), 0.5),
+    'broken': (('sound/stone/broken/01.wav', 'sound/stone/broken/02.wav'), 0.3),
+    'crystal_get': (('sound/crystal/get/01.wav', 'sound/crystal/get/02.wav',
+                     'sound/crystal/get/03.wav', 'sound/crystal/get/04.wav'), 0.8)
+}
+# 已读取的音效包
+_sound_bank: dict[str, Tuple[pygame.mixer.Sound, ...]] = {}
+
+
+def get_sounds(name: str) -> Tuple[pygame.mixer.Sound, ...]:
+    """返回音效包，每个文件只在第一次用到时读取一次，并设置好音量"""
+    if name not in _sound_bank:
+        paths, volume = sound_files[name]
+        sounds = tuple(pygame.mixer.Sound(open_asset(path)) for path in paths)
+        for sound_ in sounds:
+            sound_.set_volume(volume)
+        _sound_bank[name] = sounds
+    return _sound_bank[name]
+
+
+def play_sound(name: str) -> None:
     """播放给定音效包的随机音效"""
+    sound = get_sounds(name)
     sound[randint(0, len(sound) - 1)].play()
 
 
-def write_archive(archive: dict):
+# 存档文件（core.Archive的格式），以及旧版本的json存档
+archive_path = 'archive.sav'
+json_archive_path = 'archive.json'
+
+
+def write_archive(archive: dict, path: str = archive_path):
     """将内存中的存档，以文件形式保存在硬盘"""
-    with open('archive.json', 'w') as f:
-        f.write(json.dumps(archive, indent=2))
+    with open(path, 'wb') as f:
+        f.write(Archive.pack(archive))
 
 
-def read_archive() -> dict:
-    """从硬盘读取存档，储存在内内存中"""
-    if not os.path.exists('archive.json'):
+def read_archive(path: str = archive_path, json_path: Union[str, None] = json_archive_path) -> dict:
+    """从硬盘读取存档，储存在内内存中。只有旧的json存档时读取并转换它，下次保存时写成新的格式"""
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            return Archive.unpack(f.read())
+    if json_path is None or not os.path.exists(json_path):
         return {}
-    with open('archive.json', 'r') as f:
+    with open(json_path, 'r') as f:
         archive = json.loads(str_) if (str_ := f.read()) else {}
-    return archive
+    return Archive.migrate(archive)
+
+
+def lerp(last: Union[list, tuple], now: Union[list, tuple]) -> list:
+    """
+    绘制时在上一步和这一步的数值之间按Game.alpha插值
+    模拟时Game.alpha为1，直接返回这一步的数值，所以模拟结果与绘制帧率无关
+    """
+    alpha = Game.alpha
+    if alpha >= 1:
+        return list(now)
+    return [round(last_ + (now_ - last_) * alpha) for last_, now_ in zip(last, now)]
+
+
+def get_camera() -> Tuple[int, int]:
+    """镜头左上角的pos（像素位置）"""
+    player = Level.get_inst().sim.player
+    pos_x, pos_y, offset = lerp((*player.last_pos, player.last_offset), (*player.pos, player.offset))
+    # 世界比窗口宽时，水平方向以玩家为中心，并限制在世界之内
+    x_offset = min(max(pos_x + brick_len // 2 - screen_size[0] // 2, 0),
+                   max(world_size[0] * brick_len - screen_size[0], 0))
+    return x_offset, pos_y - offset
 
 
 def get_relative_pos(pos_: list[int, int]) -> tuple:
@@ -70,42 +275,14 @@ def get_relative_pos(pos_: list[int, int]) -> tuple:
     :param pos_: pos（像素位置）
     :return: rect.top_left（屏幕位置）
     """
-    return pos_[0], pos_[1] - Player.get_inst().pos[1] + Player.get_inst().offset
-
-
-def _get_pla(player: 'Player') -> dict:
-    return {
-        'gird_pos': player.gird_pos,
-        'pos': player.pos,
-        'status': player.status,
-        'health': player.health,
-        'on_brick': player.on_brick,
-        'move_time': player.move_time,
-        'destroy_time': player.destroy_time,
-        'offset': player.offset,
-        'at_sub': player.at_sub,
-        'moving': player.moving,
-        'moving_u': player.moving_u
-    }
-
-
-def _get_bri(brick: Union['Soil', 'Stone', int]) -> Union[int, Tuple[int, int], None]:
-    if type(brick) == int:
-        return None
-    elif hasattr(brick, 'health'):
-        return brick.color, brick.health
-    else:
-        return brick.color
+    camera = get_camera()
+    return pos_[0] - camera[0], pos_[1] - camera[1]
 
 
-def _get_cry(cry: 'Crystal') -> dict:
-    return {'color': cry.color, 'gird_pos': cry.gird_pos, 'pos': cry.pos, 'on_brick': cry.on_brick}
-
-
-def _get_fra(sprite) -> dict:
-    fra: 'Fragment' = sprite
-    return {'color': fra.color, 'pos': fra.pos, 'speed': fra.speed, 'vertical_speed': fra.vertical_speed,
-            'stepx': fra.stepx, 'stepy': fra.stepy}
+def get_visible_rows() -> range:
+    """镜头中能看到的行（包括只露出一部分的行）"""
+    camera_y = get_camera()[1]
+    return range(camera_y // brick_len, (camera_y + screen_size[1] - 1) // brick_len + 1)
 
 
 def _get_lev() -> int:
@@ -114,22 +291,9 @@ def _get_lev() -> int:
 
 def get_archive() -> dict:
     """获取存档，并储存在内存中"""
-    player = Player.get_inst()
-    bricks = Bricks.get_inst()
-    crystals = Crystals.get_inst()
-    backpack = Backpack.get_inst()
-    fragments = Fragments.get_inst()
-    return {
-        'player': _get_pla(player),
-        'bricks': {
-            'b_list2': [list(map(_get_bri, bricks.b_list2[_])) for _ in range(10)],
-            'floor': bricks.floor,
-            'colors': bricks.colors
-        },
-        'crystals': list(map(_get_cry, crystals.group)),
-        'backpack': [cry.num for cry in backpack.bag_crystals],
-        'fragments': list(map(_get_fra, fragments.sprites()))
-    }
+    archive = Level.get_inst().sim.dump()
+    archive['fragments'] = Fragments.get_inst().dump()
+    return archive
 
 
 def get_archives() -> dict:
@@ -138,14 +302,8 @@ def get_archives() -> dict:
     return dict_
 
 
-def load_cry(data: dict):
-    cry = Crystal(data['color'], data['gird_pos'])
-    cry.pos = data['pos']
-    cry.on_brick = data['on_brick']
-    return cry
-
-
 class Player:
+    """绘制core.PlayerState"""
     _instance: 'Player' = None
 
     def __new__(cls, *args, **kwargs):
@@ -160,261 +318,24 @@ class Player:
     def get_inst(cls):
         return cls._instance
 
-    def __init__(self, gx: int, gy: int):
-        self.gird_pos = [gx, gy]
-        self.pos = pixel_units(self.gird_pos)
-        self.status = 'down'
-        self.image_dict = {
-            'up': pygame.image.load('image/player/up.png').convert_alpha(),
-            'down': pygame.image.load('image/player/down.png').convert_alpha(),
-            'left': pygame.image.load('image/player/left.png').convert_alpha(),
-            'right': pygame.image.load('image/player/right.png').convert_alpha()
-        }
-        self.image = self.image_dict[self.status]
-        self.rect = self.image.get_rect()
-        self.health = 255
-        self.on_brick = False
-        # 移动、破坏方块冷却
-        self.move_cool = 18
-        self.move_time = 2 * self.move_cool
-        self.destroy_cool = 15
-        self.destroy_time = 2 * self.destroy_cool
-        # 偏移，player相对于窗口最上顶的距离
-        self.offset = 7 * brick_len
-        # 玩家是否到这一层底部。
-        self.at_sub = False
-        self.moving: int = 0  # 0：不动，1：左，2：右
-        self.moving_u = False
-        # 速度、下落速度，单位是每帧移动像素数。
-        self.speed = 4
-        self.fall_speed = 4
-        self.off_speed = 3
-
-    def load(self, data: dict):
-        self.gird_pos = data['gird_pos']
-        self.pos = data['pos']
-        self.status = data['status']
-        self.health = data['health']
-        self.on_brick = data['on_brick']
-        self.destroy_time = data['destroy_time']
-        self.offset = data['offset']
-        self.at_sub = data['at_sub']
-        self.moving = data['moving']
-        self.moving_u = data['moving_u']
-
-    def destroy_begin(self):
-        self.destroy_time = self.destroy_cool
-
-    def move_begin(self):
-        self.move_time = self.move_cool
-
-    def destroy(self, status: str):
-        Level.get_inst().input_idle = 0
-        if self.destroy_time != 0:
-            return
-        self.destroy_begin()
-        # 以下为根据player方向改变
-        if status == 'left' and Bricks.c_get_brick(self.gird_pos[0] - 1, self.gird_pos[1]):
-            Bricks.get_inst().destroy_brick(self.gird_pos[0] - 1, self.gird_pos[1])
-        elif status == 'right' and Bricks.c_get_brick(self.gird_pos[0] + 1, self.gird_pos[1]):
-            Bricks.get_inst().destroy_brick(self.gird_pos[0] + 1, self.gird_pos[1])
-        elif status == 'up' and Bricks.c_get_brick(self.gird_pos[0], self.gird_pos[1] - 1):
-            Bricks.get_inst().destroy_brick(self.gird_pos[0], self.gird_pos[1] - 1)
-        elif status == 'down' and Bricks.c_get_brick(self.gird_pos[0], self.gird_pos[1] + 1):
-            Bricks.get_inst().destroy_brick(self.gird_pos[0], self.gird_pos[1] + 1)
-        else:
-            return
-        self.health -= 1
-
-    def input(self):
-        keys = pygame.key.get_pressed()
-        if keys[pygame.K_SPACE]:
-            self.destroy(self.status)
-        if keys[pygame.K_UP]:
-            self.status = 'up'
-            Level.get_inst().input_idle = 0
-        elif keys[pygame.K_DOWN]:
-            self.status = 'down'
-            Level.get_inst().input_idle = 0
-        if keys[pygame.K_LEFT]:
-            self.decide_move_left()
-        elif keys[pygame.K_RIGHT]:
-            self.decide_move_right()
-
-    # 是否触地的检测，由fall调用
-    def _detect_on_break(self):
-        self.on_brick = True if self.moving_u else bool(Bricks.c_get_brick(self.gird_pos[0], self.gird_pos[1] + 1))
-
-    # 落入下一格，由fall调用
-    def _fall_next(self):
-        if not self.on_brick:
-            if self.pos[1] < (self.gird_pos[1] + 1) * brick_len:
-                self.pos[1] += self.fall_speed
-            else:
-                self.gird_pos[1] += 1
-                self.pos[1] = self.gird_pos[1] * brick_len
-
-    def fall(self):
-        self._detect_on_break()
-        self._fall_next()
-
-    # 向右向移动决定，由input调用
-    def decide_move_right(self):
-        self.status = 'right'
-        if self.move_time == 0 and self.gird_pos[0] < 9 and self.on_brick:
-            if not Bricks.c_get_brick(self.gird_pos[0] + 1, self.gird_pos[1]):
-                self.moving = 2
-            elif not Bricks.c_get_brick(self.gird_pos[0] + 1, self.gird_pos[1] - 1) \
-                    and not Bricks.c_get_brick(self.gird_pos[0], self.gird_pos[1] - 1):
-                self.moving = 2
-                self.moving_u = True
-            self.move_begin()
-        Level.get_inst().input_idle = 0
-
-    # 向左方向移动决定，由input调用
-    def decide_move_left(self):
-        self.status = 'left'
-        if self.move_time == 0 and self.gird_pos[0] > 0 and self.on_brick:
-            if not Bricks.c_get_brick(self.gird_pos[0] - 1, self.gird_pos[1]):
-                self.moving = 1
-            elif not Bricks.c_get_brick(self.gird_pos[0] - 1, self.gird_pos[1] - 1) \
-                    and not Bricks.c_get_brick(self.gird_pos[0], self.gird_pos[1] - 1):
-                self.moving = 1
-                self.moving_u = True
-            self.move_begin()
-        Level.get_inst().input_idle = 0
-
-    # 向右移动，由move调用
-    def move_right(self):
-        if self.pos[0] < (self.gird_pos[0] + 1) * brick_len:
-            self.pos[0] += self.speed  # 最后一个100是帧率
-        else:
-            self.moving = 0
-            self.gird_pos[0] += 1
-            self.pos[0] = self.gird_pos[0] * brick_len
-
-    # 向左移动，由move调用
-    def move_left(self):
-        if self.pos[0] > (self.gird_pos[0] - 1) * brick_len:
-            self.pos[0] -= self.speed  # 最后一个100是帧率
-        else:
-            self.moving = 0
-            self.gird_pos[0] -= 1
-            self.pos[0] = self.gird_pos[0] * brick_len
-
-    # 向上移动，由move调用
-    def move_up(self):
-        if self.pos[1] > (self.gird_pos[1] - 1) * brick_len:
-            self.pos[1] -= self.speed
-        else:
-            self.moving_u = False
-            self.gird_pos[1] -= 1
-            self.pos[1] = self.gird_pos[1] * brick_len
-
-    def move(self):
-        if self.moving == 2:
-            self.move_right()
-        elif self.moving == 1:
-            self.move_left()
-        if self.moving_u:
-            self.move_up()
-
-    def set_offset(self):
-        if self.at_sub:
-            # 2 状态
-            if self.gird_pos[1] >= 92:
-                self.offset = max(self.pos[1] - 85 * brick_len, 7 * brick_len)
-            # 2 -> 1 状态
-            elif self.offset > 7 * brick_len:
-                self.offset -= self.off_speed
-            else:
-                # 正式进入 1
-                self.at_sub = False
-                self.offset = 7 * brick_len
-        # 1 -> 2
-        elif self.gird_pos[1] >= 92:
-            self.at_sub = True
-
-    def cooling_down(self):
-        self.move_time -= 1
-        self.move_time = max(self.move_time, 0)
-        self.destroy_time -= 1
-        self.destroy_time = max(self.destroy_time, 0)
-
-    def draw(self, surface: pygame.Surface):
-        self.image = self.image_dict[self.status]
-        self.rect.topleft = get_relative_pos(self.pos)
-        surface.blit(self.image, self.rect)
-
-    def update(self):
-        self.fall()
-        self.move()
-        self.set_offset()
-        self.cooling_down()
-
-
-class Brick:
-    def __init__(self, color: int, gird_pos: list[int, int]):
-        self.color: int = color
-        self.gird_pos = gird_pos
-        self.pos = pixel_units(gird_pos)
-        # 所属的链，用于连锁破坏。0代表不属于任何链
-        self.belong_chain = 0
-
-
-class Soil(Brick):
-    soil_image: Tuple[pygame.Surface] = (
-        pygame.image.load('image/brick/red.png'),
-        pygame.image.load('image/brick/yellow.png'),
-        pygame.image.load('image/brick/green.png'),
-        pygame.image.load('image/brick/blue.png'),
-        pygame.image.load('image/brick/purple.png'),
-        pygame.image.load('image/brick/orange.png'),
-        pygame.image.load('image/brick/pink.png'),
-        pygame.image.load('image/brick/indigo.png'),
-    )
-    sub_image: pygame.Surface = pygame.image.load('image/brick/sub_brick.png')
-
-    def __init__(self, color: int, gird_pos: list[int, int]):
-        super().__init__(color, gird_pos)
-        if self.color == 31:
-            self.image = self.__class__.sub_image.convert()
-        else:
-            self.image = self.__class__.soil_image[self.color].convert()
-        self.rect = self.image.get_rect()
-
-    def draw(self, surface: pygame.Surface):
-        self.rect.topleft = get_relative_pos(self.pos)
-        surface.blit(self.image, self.rect)
-
-
-class Stone(Brick):
-    images: Tuple[pygame.Surface] = (
-        pygame.image.load('image/brick/stone/Stone5-1.png'),
-        pygame.image.load('image/brick/stone/Stone5-2.png'),
-        pygame.image.load('image/brick/stone/Stone5-3.png'),
-        pygame.image.load('image/brick/stone/Stone5-4.png'),
-        pygame.image.load('image/brick/stone/Stone5-5.png')
-    )
-
-    def __init__(self, color: int, gird_pos: list[int, int]):
-        super().__init__(color, gird_pos)
-        self.health = 5
-        self.image = self.__class__.images[self.health - 1].convert()
+    def __init__(self, state: 'PlayerState'):
+        self.state = state
+        self.image_dict = {status: convert_image(get_asset(f'player/{status}'), True)
+                           for status in ('up', 'down', 'left', 'right')}
+        self.image = self.image_dict[self.state.status]
         self.rect = self.image.get_rect()
 
     def draw(self, surface: pygame.Surface):
-        self.image = self.__class__.images[self.health - 1].convert()
-        self.rect.topleft = get_relative_pos(self.pos)
+        self.image = self.image_dict[self.state.status]
+        self.rect.topleft = get_relative_pos(lerp(self.state.last_pos, self.state.pos))
         surface.blit(self.image, self.rect)
 
 
-def create_brick(color: int, gird_pos: [int, int]):
-    return Stone(color, gird_pos) if color == 8 else Soil(color, gird_pos)
-
-
 class Bricks:
+    """绘制core.Field，每块的图层随Simulation.events更新"""
     _instance: 'Bricks' = None
+    # 图层中代表空位置的透明色
+    layer_key = (255, 0, 255)
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -425,236 +346,185 @@ class Bricks:
     def get_inst(cls):
         return cls._instance
 
-    @classmethod
-    def c_get_brick(cls, gx: int, gy: int) -> Union['Soil', 'Stone', None, int]:
-        """
-        为了区分该方法与对象的get_brick方法，在函数名开头加c，表示是类方法
-        :param gx:
-        :param gy:
-        :return:
-        """
-        return cls._instance.get_brick(gx, gy)
-
-    def __init__(self):
-        # 添加brick发生在level的set_floor里
-        self.b_list2: list[list[Union['Soil', 'Stone', int]]] = []
-        self.chain2: list[list['Soil', 'Stone']] = []
-        self.chain_order = 0
-        # 层数
-        self.floor = 0
-        self.colors: list[int, ...] = sample(range(9), 5)
-        # 设置音效
-        self.soil_sound = (
-            pygame.mixer.Sound('sound/soil/01.wav'),
-            pygame.mixer.Sound('sound/soil/02.wav'),
-            pygame.mixer.Sound('sound/soil/03.wav'),
-            pygame.mixer.Sound('sound/soil/04.wav')
-        )
-        self.stone_sound = (
-            pygame.mixer.Sound('sound/stone/01.wav'),
-            pygame.mixer.Sound('sound/stone/02.wav'),
-            pygame.mixer.Sound('sound/stone/03.wav'),
-            pygame.mixer.Sound('sound/stone/04.wav')
-        )
-        self.broken_sound = (
-            pygame.mixer.Sound('sound/stone/broken/01.wav'),
-            pygame.mixer.Sound('sound/stone/broken/02.wav')
-        )
-        self.set_volumes()
-
-    # 设置音量
-    def set_volumes(self):
-        for sound_ in self.soil_sound:
-            sound_.set_volume(0.3)
-        for sound_ in self.stone_sound:
-            sound_.set_volume(0.5)
-        for sound_ in self.broken_sound:
-            sound_.set_volume(0.3)
-
-    def load_bricks(self, b_list2_):
-        for gx, list1_ in enumerate(b_list2_):
-            b_list1: list[Union['Soil', 'Stone', int]] = []
-            for gy, brick_ in enumerate(list1_):
-                if type(brick_) == int:
-                    brick = create_brick(brick_, [gx, gy])
-                elif type(brick_) in (list, tuple):
-                    brick = create_brick(brick_[0], [gx, gy])
-                    brick.health = brick_[1]
-                else:
-                    brick = 0
-                b_list1.append(brick)
-            self.b_list2.append(b_list1)
-
-    def load(self, data: dict):
-        self.floor = data['floor']
-        self.colors = data['colors']
-        self.load_bricks(data['b_list2'])
-        self.update_chain2()
-
-    # 返回指定brick
-    def get_brick(self, gx: int, gy: int) -> Union['Soil', 'Stone', None, int]:
-        return self.b_list2[gx][gy] if 0 <= gx <= 9 and 0 <= gy <= 99 else None
-
-    # 摧毁单个，无视血量。在血量<=0时或使用水晶时调用，调用前要先判断是否为0
-    def destroy_one(self, gx: int, gy: int):
-        aim_brick = self.b_list2[gx][gy]
-        # 产生粒子
-        if not aim_brick:
-            return
-        Fragment.produce(aim_brick.color, aim_brick.pos)
-        self.b_list2[gx][gy] = 0
-
-    # 摧毁石头，由destroy_brick调用
-    def destroy_stone_chain1(self, chain1: list['Stone', ...]):
-        # 扣血
-        be_broken = False
-        for brick in chain1:
-            brick.health -= 1
-            if brick.health <= 0:
-                be_broken = True
-                self.destroy_one(brick.gird_pos[0], brick.gird_pos[1])
-        # 播放声音
-        if be_broken:
-            play_sound(self.broken_sound)
-        else:
-            play_sound(self.stone_sound)
-
-    # 玩家摧毁方块，调用前要先判断是否为0
-    def destroy_brick(self, gx: int, gy: int):
-        chain1 = self.chain2[self.b_list2[gx][gy].belong_chain]
-        if isinstance(chain1[0].color, Stone):
-            stone_chain1: list['Stone', ...] = chain1
-            self.destroy_stone_chain1(stone_chain1)
+    def __init__(self, field: 'Field'):
+        self.field = field
+        # 按颜色查找的图片
+        self.soil_images = tuple(map(convert_image, get_asset('brick/soil')))
+        self.sub_image = convert_image(get_asset('brick/sub'))
+        self.stone_images = tuple(map(convert_image, get_asset('brick/stone')))
+        # 每块（chunk）预先绘制好的图层，键为块的序号gy // chunk_rows
+        self.layers: dict[int, pygame.Surface] = {}
+        # 变化过、还没重新绘制到图层上的格子
+        self.dirty_cells: set[Tuple[int, int]] = set()
+        # 每次画面上的砖块有变化时加一，用于判断画面是否需要重画
+        self.revision = 0
+
+    def handle(self, event: tuple):
+        """按Simulation.events中的一项更新图层"""
+        kind = event[0]
+        if kind == 'clear':
+            self.layers.clear()
+            self.dirty_cells.clear()
+        elif kind == 'rows':
+            self._render_layers(event[1], event[2])
+        elif kind == 'evict':
+            self.layers.pop(event[1] // chunk_rows, None)
+        elif kind == 'destroy':
+            self.dirty_cells.add((event[2], event[3]))
+        elif kind == 'damage':
+            self.dirty_cells.add((event[1], event[2]))
         else:
-            if chain1[0].color == 31:
-                Level.get_inst().need_next = True
-            for brick in chain1:
-                self.destroy_one(brick.gird_pos[0], brick.gird_pos[1])
-            play_sound(self.soil_sound)
-
-    # 通过update_chain1调用，为一个chain1（不是chain2）添加所有应添加的brick，并更新这些brick的belong_chain
-    def update_chain1(self, gx: int, gy: int, ch_index: int):
-        # 赋值
-        self.b_list2[gx][gy].belong_chain = ch_index
-        self.chain2[ch_index].append(self.b_list2[gx][gy])
-        color = self.b_list2[gx][gy].color
-
-        # 链锁赋值判定
-        # 左。不是左边界，左边是brick，左边颜色和自己相同，左边没chain
-        if gx > 0 and self.b_list2[gx - 1][gy] \
-                and self.b_list2[gx - 1][gy].color == color \
-                and not self.b_list2[gx - 1][gy].belong_chain:
-            self.update_chain1(gx - 1, gy, ch_index)
-
-        # 右
-        if gx < len(self.b_list2) - 1 and self.b_list2[gx + 1][gy] \
-                and self.b_list2[gx + 1][gy].color == color \
-                and not self.b_list2[gx + 1][gy].belong_chain:
-            self.update_chain1(gx + 1, gy, ch_index)
-
-        # 上
-        if gy > 0 and self.b_list2[gx][gy - 1] \
-                and self.b_list2[gx][gy - 1].color == color \
-                and not self.b_list2[gx][gy - 1].belong_chain:
-            self.update_chain1(gx, gy - 1, ch_index)
-
-        # 下
-        if gy < len(self.b_list2[gx]) - 1 and self.b_list2[gx][gy + 1] \
-                and self.b_list2[gx][gy + 1].color == color \
-                and not self.b_list2[gx][gy + 1].belong_chain:
-            self.update_chain1(gx, gy + 1, ch_index)
-
-    # 更新chain2
-    def update_chain2(self):
-        # 初始化
-        if not self.b_list2:
             return
-        self.chain_order = 0
-        # chain2的每一个元素为chain1
-        self.chain2 = [None]
-        for gx, _ in enumerate(self.b_list2):
-            for gy, brick in enumerate(_):
-                if not brick or brick.belong_chain:
-                    continue
-                self.chain_order += 1
-                self.chain2.append([])
-                self.update_chain1(gx, gy, self.chain_order)
-
-    def update(self):
-        ...
-        # for _ in self.b_list2:
-        #     for brick in _:
-        #         if brick:
-        #             brick.update()
-        # self.update_chain2()
+        self.revision += 1
+
+    def brick_image(self, color: int, health: int) -> pygame.Surface:
+        if color == 31:
+            return self.sub_image
+        elif color == Stone.color:
+            return self.stone_images[health - 1]
+        return self.soil_images[color]
+
+    def _render_layers(self, top: int, bottom: int):
+        """重新绘制[top, bottom)行所在的块的图层，空位置为透明色"""
+        grid = self.field.grid
+        for k in range(top // chunk_rows, (bottom - 1) // chunk_rows + 1):
+            layer = pygame.Surface((grid.width * brick_len, chunk_rows * brick_len))
+            layer.fill(self.__class__.layer_key)
+            layer.set_colorkey(self.__class__.layer_key)
+            blit_list = []
+            for gy in range(max(k * chunk_rows, grid.top), min((k + 1) * chunk_rows, grid.bottom)):
+                row_index = (gy - grid.top) * grid.width
+                for gx in range(grid.width):
+                    color = grid.color[row_index + gx]
+                    if color != grid.EMPTY:
+                        blit_list.append((self.brick_image(color, grid.health[row_index + gx]),
+                                          (gx * brick_len, (gy - k * chunk_rows) * brick_len)))
+            layer.blits(blit_list, False)
+            self.layers[k] = layer
+
+    def _patch_layers(self):
+        """只在变化过的格子上重新绘制"""
+        grid = self.field.grid
+        for gx, gy in self.dirty_cells:
+            layer = self.layers.get(gy // chunk_rows)
+            if layer is None:
+                continue
+            pos = (gx * brick_len, gy % chunk_rows * brick_len)
+            color = grid.get(gx, gy)
+            if color is None:
+                layer.fill(self.__class__.layer_key, (pos, (brick_len, brick_len)))
+            else:
+                layer.blit(self.brick_image(color, grid.health[grid.index(gx, gy)]), pos)
+        self.dirty_cells.clear()
 
     def draw(self, surface: pygame.Surface):
-        for _ in self.b_list2:
-            for brick in _:
-                if brick:
-                    brick.draw(surface)
-
-
-class Fragment(pygame.sprite.Sprite):
-    f_kind = (
-        pygame.image.load('image/fragment/red.png'),
-        pygame.image.load('image/fragment/yellow.png'),
-        pygame.image.load('image/fragment/green.png'),
-        pygame.image.load('image/fragment/blue.png'),
-        pygame.image.load('image/fragment/purple.png'),
-        pygame.image.load('image/fragment/orange.png'),
-        pygame.image.load('image/fragment/pink.png'),
-        pygame.image.load('image/fragment/indigo.png'),
-        pygame.image.load('image/fragment/stone_five.png')
-    )
+        """只把镜头中能看到的块的图层贴上去"""
+        self._patch_layers()
+        camera = get_camera()
+        rows = get_visible_rows()
+        for k in range(rows.start // chunk_rows, (rows.stop - 1) // chunk_rows + 1):
+            if k in self.layers:
+                surface.blit(self.layers[k], (-camera[0], k * chunk_rows * brick_len - camera[1]))
 
-    @classmethod
-    def produce(cls, color: int, pos: list[int, int]):
-        if color != 31:
-            cls(color, pos)
-            cls(color, pos)
 
-    def __init__(self, color: int, pos: list[int, int]):
-        super().__init__(Fragments.get_inst())
-        self.color = color
-        # pos为中心位置，要传入stone.pos
-        self.pos = [pos[0] + brick_len // 2, pos[1] + brick_len // 2]
-        self.image = self.__class__.f_kind[color]
-        self.rect = self.image.get_rect()
-        self.speed = randint(-7, 7) * 5
-        self.vertical_speed = 0
-        self.stepx = 0
-        self.stepy = 0
-        self.gravity = 3
-
-    def miss(self):
-        if self.rect.y >= screen_size[1] + 50:
-            self.kill()
+class Particles:
+    """
+    固定容量的粒子系统，每个属性存在一个数组中，存活的粒子排在前count个
+    速度和重力以0.1像素为单位，step为不足1像素的累计；坐标为粒子中心
+    """
 
-    def move_x(self):
-        self.stepx += self.speed
-        if self.stepx // 10 != 0:
-            self.pos[0] += self.stepx // 10
-            self.stepx -= self.stepx // 10 * 10
+    def __init__(self, capacity: int = 1024):
+        self.capacity = capacity
+        self.count = 0
+        self.gravity = 3
+        self.color = array('B', bytes(capacity))
+        self.x = array('i', bytes(4 * capacity))
+        self.y = array('i', bytes(4 * capacity))
+        self.speed = array('i', bytes(4 * capacity))
+        self.vertical_speed = array('i', bytes(4 * capacity))
+        self.stepx = array('i', bytes(4 * capacity))
+        self.stepy = array('i', bytes(4 * capacity))
+
+    def add(self, color: int, x: int, y: int, speed: int, vertical_speed: int = 0, stepx: int = 0, stepy: int = 0):
+        """加入一个粒子，已满时忽略"""
+        if self.count >= self.capacity:
+            return
+        i = self.count
+        self.color[i] = color
+        self.x[i] = x
+        self.y[i] = y
+        self.speed[i] = speed
+        self.vertical_speed[i] = vertical_speed
+        self.stepx[i] = stepx
+        self.stepy[i] = stepy
+        self.count += 1
+
+    def produce(self, color: int, center: list[int, int]):
+        """破坏一个方块，产生两个粒子"""
+        if color != 31:
+            self.add(color, center[0], center[1], randint(-7, 7) * 5)
+            self.add(color, center[0], center[1], randint(-7, 7) * 5)
+
+    def clear(self):
+        self.count = 0
+
+    def _kill(self, i: int):
+        """用最后一个粒子填补第i个"""
+        last = self.count - 1
+        for plane in (self.color, self.x, self.y, self.speed, self.vertical_speed, self.stepx, self.stepy):
+            plane[i] = plane[last]
+        self.count = last
+
+    def update(self, limit: int):
+        """所有存活的粒子前进一帧，y不小于limit的粒子消失"""
+        x, y, speed, vertical_speed, stepx, stepy = \
+            self.x, self.y, self.speed, self.vertical_speed, self.stepx, self.stepy
+        gravity = self.gravity
+        i = 0
+        while i < self.count:
+            if y[i] >= limit:
+                self._kill(i)
+                continue
+            move, stepx[i] = divmod(stepx[i] + speed[i], 10)
+            x[i] += move
+            vertical_speed[i] += gravity
+            move, stepy[i] = divmod(stepy[i] + vertical_speed[i], 10)
+            y[i] += move
+            i += 1
+
+    def draw(self, surface: pygame.Surface, images: Tuple[pygame.Surface, ...], camera: Tuple[int, int] = (0, 0)):
+        """以一次blits绘制surface范围内的粒子，images按颜色排列"""
+        halves = [(image.get_width() // 2, image.get_height() // 2) for image in images]
+        width, height = surface.get_size()
+        blit_list = []
+        for i in range(self.count):
+            image = images[self.color[i]]
+            half_w, half_h = halves[self.color[i]]
+            left = self.x[i] - camera[0] - half_w
+            top = self.y[i] - camera[1] - half_h
+            if -2 * half_w < left < width and -2 * half_h < top < height:
+                blit_list.append((image, (left, top)))
+        surface.blits(blit_list, False)
+
+    def dump(self) -> list[dict]:
+        return [{'color': self.color[i], 'pos': [self.x[i], self.y[i]], 'speed': self.speed[i],
+                 'vertical_speed': self.vertical_speed[i], 'stepx': self.stepx[i], 'stepy': self.stepy[i]}
+                for i in range(self.count)]
 
-    def move_y(self):
-        self.vertical_speed += self.gravity
-        self.stepy += self.vertical_speed
-        if self.stepy // 10 != 0:
-            self.pos[1] += self.stepy // 10
-            self.stepy %= 10
+    def load(self, data: list[dict]):
+        """换成存档中的粒子"""
+        self.clear()
+        for fra_ in data:
+            self.add(fra_['color'], fra_['pos'][0], fra_['pos'][1], fra_['speed'],
+                     fra_['vertical_speed'], fra_['stepx'], fra_['stepy'])
 
-    def move(self):
-        self.move_x()
-        self.move_y()
-        self.rect.center = get_relative_pos(self.pos)
 
-    def update(self):
-        self.miss()
-        self.move()
+def fragment_images() -> Tuple[pygame.Surface, ...]:
+    return tuple(convert_image(image, True) for image in get_asset('fragment'))
 
 
-class Fragments(pygame.sprite.Group):
+class Fragments(Particles):
+    """关卡中破坏方块产生的粒子，坐标为pos（像素位置）"""
     _instance: 'Fragments' = None
 
     def __new__(cls, *args, **kwargs):
@@ -666,88 +536,16 @@ class Fragments(pygame.sprite.Group):
     def get_inst(cls):
         return cls._instance
 
-    def load(self, data: list[dict]):
-        for fra_ in data:
-            fra = Fragment(fra_['color'], fra_['pos'])
-            fra.speed = fra_['speed']
-            fra.vertical_speed = fra_['vertical_speed']
-            fra.stepx = fra_['stepx']
-            fra.stepy = fra_['stepy']
-            self.add(fra)
-
-
-class Crystal:
-    c_kind = (
-        pygame.image.load('image/crystal/CrystalRed.png'),
-        pygame.image.load('image/crystal/CrystalYellow.png'),
-        pygame.image.load('image/crystal/CrystalGreen.png'),
-        pygame.image.load('image/crystal/CrystalBlue.png'),
-        pygame.image.load('image/crystal/CrystalPurple.png'),
-        pygame.image.load('image/crystal/CrystalOrange.png'),
-        pygame.image.load('image/crystal/CrystalPink.png'),
-        pygame.image.load('image/crystal/CrystalIndigo.png'),
-        pygame.image.load('image/crystal/Crystal_stone_five.png')
-    )
-
-    def __init__(self, color: int, gird_pos: list[int, int]):
-        Crystals.get_inst().group.append(self)
-        self.color = color
-        self.gird_pos: list[int, int] = gird_pos
-        self.pos = pixel_units(self.gird_pos)
-        self.image = self.__class__.c_kind[self.color].convert_alpha()
-        self.rect = self.image.get_rect()
-        # 吸收音效
-        self.eat_sound = (
-            pygame.mixer.Sound('sound/crystal/get/01.wav'),
-            pygame.mixer.Sound('sound/crystal/get/02.wav'),
-            pygame.mixer.Sound('sound/crystal/get/03.wav'),
-            pygame.mixer.Sound('sound/crystal/get/04.wav')
-        )
-        for sound_ in self.eat_sound:
-            sound_.set_volume(0.8)
-        self.on_brick = True
-        self.fall_speed = 4
-
-    # 玩家吸收水晶
-    def be_eaten(self):
-        # 玩家处在水晶的位置，且背包未满
-        if self.gird_pos == Player.get_inst().gird_pos and \
-                Backpack.get_inst().crystal_num < Backpack.get_inst().max_value:
-            # 向背包里添加水晶
-            Backpack.get_inst().add_crystal(self.color, 1)
-            # 移除场地的水晶
-            Crystals.get_inst().group.remove(self)
-            # 播放吸收音效
-            play_sound(self.eat_sound)
-
-    # 是否触地的检测，由fall调用
-    def detect_on_break(self):
-        self.on_brick = bool(Bricks.c_get_brick(self.gird_pos[0], self.gird_pos[1] + 1))
-
-    # 落入下一格，由fall调用
-    def fall_next(self):
-        if not self.on_brick:
-            if self.pos[1] < (self.gird_pos[1] + 1) * brick_len:
-                self.pos[1] += self.fall_speed
-            else:
-                self.gird_pos[1] += 1
-                self.pos[1] = self.gird_pos[1] * brick_len
-
-    # 下落模块，由update调用
-    def fall(self):
-        self.detect_on_break()
-        self.fall_next()
+    def update(self):
+        # 落到窗口下方50像素以外时消失
+        super().update(get_camera()[1] + screen_size[1] + 50)
 
     def draw(self, surface: pygame.Surface):
-        self.rect.topleft = get_relative_pos(self.pos)
-        surface.blit(self.image, self.rect)
-
-    def update(self):
-        self.be_eaten()
-        self.fall()
+        super().draw(surface, fragment_images(), get_camera())
 
 
 class Crystals:
+    """绘制core.CrystalSet"""
     _instance: 'Crystals' = None
 
     def __new__(cls, *args, **kwargs):
@@ -759,69 +557,42 @@ class Crystals:
     def get_inst(cls):
         return cls._instance
 
-    def __init__(self):
-        self.group: list['Crystal'] = []
-
-    def load(self, data: list[dict]):
-        self.group = list(map(load_cry, data))
-
-    def update(self):
-        for crystal_ in self.group:
-            crystal_.update()
+    def __init__(self, crystals: 'CrystalSet'):
+        self.crystals = crystals
+        # 按颜色排列的图片
+        self.images = tuple(convert_image(image, True) for image in get_asset('crystal'))
 
     def draw(self, surface):
-        for crystal_ in self.group:
-            crystal_.draw(surface)
+        """只绘制镜头中能看到的水晶"""
+        camera_x, camera_y = get_camera()
+        for cry in self.crystals.group:
+            if camera_y - brick_len < cry.pos[1] < camera_y + screen_size[1]:
+                pos = lerp(cry.last_pos, cry.pos)
+                surface.blit(self.images[cry.color], (pos[0] - camera_x, pos[1] - camera_y))
 
 
 class BagCrystal:
-    c_kind = Crystal.c_kind
+    """背包中一种水晶的图标和数量，数量来自core.Bag"""
 
-    def __init__(self, color: int):
+    def __init__(self, bag: 'Bag', color: int):
+        self.bag = bag
         self.color = color
-        self.num = 1
-        self.font = pygame.font.SysFont('方正粗黑宋简体', 40)
-        self.icon_image = self.__class__.c_kind[self.color].convert_alpha()
+        self.num = self.bag.nums[self.color]
+        self.font = get_font('方正粗黑宋简体', 40)
+        self.icon_image = convert_image(get_asset('crystal')[self.color], True)
         self.icon_rect: pygame.Rect = self.icon_image.get_rect(
             topleft=(30 + self.color % 2 * 150, 30 + self.color // 2 * 75))
-        self.num_image = self.font.render(str(self.num), True, (0, 0, 0))
+        # num_image上显示的数量
+        self.shown_num = self.num
+        self.num_image = render_text(self.font, str(self.num), (0, 0, 0))
         self.num_rect = self.num_image.get_rect(center=(self.icon_rect.right + 30, self.icon_rect.centery))
-        if self.color == 8:
-            self.sound = (
-                pygame.mixer.Sound('sound/stone/broken/01.wav'),
-                pygame.mixer.Sound('sound/stone/broken/02.wav')
-            )
-        else:
-            self.sound = (
-                pygame.mixer.Sound('sound/soil/01.wav'),
-                pygame.mixer.Sound('sound/soil/02.wav'),
-                pygame.mixer.Sound('sound/soil/03.wav'),
-                pygame.mixer.Sound('sound/soil/04.wav')
-            )
-        for _ in self.sound:
-            _.set_volume(0.3)
-
-    # 用水晶破坏方块，由magic调用
-    def crystal_destroy(self):
-        have_brick = False
-        for x, y in itertools.product(range(10), range(-7, 8)):
-            d_brick = Bricks.c_get_brick(x, Player.get_inst().gird_pos[1] + y)
-            # destroyed_brick可能为0（空位置），或者None（边界外），要先判断
-            if d_brick and d_brick.color == self.color:
-                have_brick = True
-                Bricks.get_inst().destroy_one(x, Player.get_inst().gird_pos[1] + y)
-        if have_brick:
-            play_sound(self.sound)
-
-    # 使用水晶
-    def magic(self):
-        if self.num <= 0:
-            return
-        self.num -= 1
-        self.crystal_destroy()
 
     def update(self):
-        self.num_image = self.font.render(str(self.num), True, (0, 0, 0))
+        self.num = self.bag.nums[self.color]
+        if self.num == self.shown_num:
+            return
+        self.shown_num = self.num
+        self.num_image = render_text(self.font, str(self.num), (0, 0, 0))
         self.num_rect = self.num_image.get_rect(center=(self.icon_rect.right + 30, self.icon_rect.centery))
 
     def draw(self, surface: pygame.Surface):
@@ -841,25 +612,21 @@ class Backpack:
     def get_inst(cls):
         return cls._instance
 
-    def __init__(self):
-        self.image = pygame.image.load('image/backpack.png').convert()
+    def __init__(self, bag: 'Bag'):
+        self.image = convert_image(get_asset('backpack'))
         self.image_copy = self.image.copy()
         self.rect = self.image.get_rect(center=(screen_size[0] // 2, screen_size[1] // 2))
-        self.bag_crystals: list['BagCrystal'] = [BagCrystal(_) for _ in range(9)]
+        self.bag_crystals: list['BagCrystal'] = [BagCrystal(bag, _) for _ in range(9)]
         self.selection = 0
-        self.arrow_image = pygame.image.load('image/arrow.png').convert_alpha()
+        self.arrow_image = convert_image(get_asset('arrow'), True)
         self.arrow_rect: pygame.Rect = self.arrow_image.get_rect(
             midright=self.bag_crystals[self.selection].icon_rect.midleft)
-        self.max_value = 32
-        self.crystal_num = 0
-
-    def load(self, data: list[int]):
-        for order, num in enumerate(data):
-            self.bag_crystals[order].num = num
+        # image_copy上各水晶显示的数量，变化时才重新合成
+        self.composed: Tuple[int, ...] = ()
 
     def re_init(self):
         self.selection = 0
-        self.arrow_rect = self.bag_crystals[self.selection].icon_rect.midleft
+        self.correct_selection()
 
     def correct_selection(self):
         """
@@ -878,9 +645,8 @@ class Backpack:
         elif key == pygame.K_z:
             Level.get_inst().status = 0
         elif key == pygame.K_SPACE:
-            self.bag_crystals[self.selection].magic()
+            Level.get_inst().use_crystal(self.selection)
             Level.get_inst().status = 0
-            Player.get_inst().destroy_begin()
         elif key == pygame.K_UP:
             self.selection -= 2
         elif key == pygame.K_DOWN:
@@ -893,26 +659,30 @@ class Backpack:
             return
         self.correct_selection()
 
-    def add_crystal(self, color: int, number: int):
-        self.bag_crystals[color].num += number
-
     def update(self):
-        self.crystal_num = 0
         for bag_crystal in self.bag_crystals:
-            self.crystal_num += bag_crystal.num
             bag_crystal.update()
 
-    def draw(self, surface: pygame.Surface):
+    def _compose(self):
+        """背景和水晶合成到image_copy上，只在数量变化时重新合成"""
+        nums = tuple(bag_crystal.shown_num for bag_crystal in self.bag_crystals)
+        if nums == self.composed:
+            return
+        self.composed = nums
         self.image_copy = self.image.copy()
         for bag_crystal in self.bag_crystals:
             bag_crystal.draw(self.image_copy)
-        self.image_copy.blit(self.arrow_image, self.arrow_rect)
+
+    def draw(self, surface: pygame.Surface):
+        self._compose()
         surface.blit(self.image_copy, self.rect)
+        # 只有箭头每帧绘制
+        surface.blit(self.arrow_image, self.arrow_rect.move(self.rect.topleft))
 
 
 class PauseButton:
     def __init__(self, name: str, order: int):
-        self.image = pygame.image.load(f'image/pause/{name}.png')
+        self.image = convert_image(get_asset(f'pause/{name}'), True)
         self.rect = self.image.get_rect(midtop=(PauseMenu.half_width(), 70 + order * 55))
 
 
@@ -940,13 +710,15 @@ class PauseMenu:
         return cls._instance.rect.width // 2
 
     def __init__(self):
-        self.image = pygame.image.load('image/pause/background.png').convert_alpha()
-        self.image_copy = self.image.copy()
+        self.image = convert_image(get_asset('pause/background'), True)
         self.rect = self.image.get_rect(center=(screen_size[0] // 2, screen_size[1] // 2))
         self.buttons = PauseButtons()
+        # 背景和按钮不会变，只合成一次
+        self.image_copy = self.image.copy()
+        self.buttons.draw(self.image_copy)
         self.buttons_pos = self.buttons.get_pos()
         self.selection = 0
-        self.arrow_image = pygame.image.load('image/arrow.png')
+        self.arrow_image = convert_image(get_asset('arrow'), True)
         self.a_rect = self.arrow_image.get_rect(midright=self.buttons_pos[self.selection])
         self.a_speed = -1
 
@@ -957,7 +729,7 @@ class PauseMenu:
     def _press_button(self):
         if self.selection == 0:
             Level.get_inst().status = 0
-            Player.get_inst().destroy_begin()
+            Level.get_inst().commands |= KEY_DESTROY_COOL
         elif self.selection == 1:
             Level.get_inst().status = 2
             Backpack.get_inst().selection = 0
@@ -988,55 +760,12 @@ class PauseMenu:
         self.swing()
 
     def draw(self, surface: pygame.Surface):
-        self.image_copy = self.image.copy()
-        self.buttons.draw(self.image_copy)
-        self.image_copy.blit(self.arrow_image, self.a_rect)
         surface.blit(self.image_copy, self.rect)
-
-
-class CaverFra(pygame.sprite.Sprite):
-    f_kind = Fragment.f_kind
-
-    @classmethod
-    def produce(cls, color: int, pos: list[int, int], creator: 'ScreenSaver'):
-        if color != 31:
-            cls(color, pos, creator)
-            cls(color, pos, creator)
-
-    def __init__(self, color: int, pos: list[int, int], creator: 'ScreenSaver'):
-        super().__init__(creator.fra_s)
-        self.color = color
-        self.image = self.__class__.f_kind[color]
-        self.rect = self.image.get_rect(center=pos)
-        self.speed = randint(-7, 7) * 5
-        self.vertical_speed = 0
-        self.stepx = 0
-        self.stepy = 0
-        self.gravity = 3
-
-    def miss(self):
-        if self.rect.y >= screen_size[1] + 50:
-            self.kill()
-
-    def move(self):
-        self.stepx += self.speed
-        if self.stepx // 10 != 0:
-            self.rect.x += self.stepx // 10
-            self.stepx -= self.stepx // 10 * 10
-        self.vertical_speed += self.gravity
-        self.stepy += self.vertical_speed
-        if self.stepy // 10 != 0:
-            self.rect.y += self.stepy // 10
-            self.stepy %= 10
-
-    def update(self):
-        self.miss()
-        self.move()
+        # 只有箭头每帧绘制
+        surface.blit(self.arrow_image, self.a_rect.move(self.rect.topleft))
 
 
 class SaverBrick:
-    images: Tuple[pygame.Surface, ...] = Soil.images + Stone.images
-
     @staticmethod
     def random_pos(size: Tuple[int, int]) -> Tuple[int, int]:
         if randint(0, 1):
@@ -1068,7 +797,7 @@ class SaverBrick:
         self.creator = creator
         self.creator.group.append(self)
         self.color = randint(0, 8)
-        self.image: pygame.Surface = self.__class__.images[self.color]
+        self.image: pygame.Surface = convert_image((get_asset('brick/soil') + get_asset('brick/stone'))[self.color])
         self.rect = self.image.get_rect(center=self.__class__.random_pos(creator.size))
         self.speed_x, self.speed_y = self.__class__.set_speed(self.rect.center)
 
@@ -1089,7 +818,7 @@ class SaverBrick:
         """随机损坏，在碰到边界时调用"""
         max_ = max(20 - len(self.creator.group), 0)
         if not randint(0, max_):
-            CaverFra.produce(self.color, [self.rect.centerx, self.rect.centery], self.creator)
+            self.creator.fra_s.produce(self.color, [self.rect.centerx, self.rect.centery])
             self.creator.del_g.append(self)
 
     def update(self):
@@ -1113,7 +842,7 @@ class ScreenSaver:
         self.size = size
         self.canvas = pygame.Surface(size)
         self.del_g: list['SaverBrick'] = []
-        self.fra_s = pygame.sprite.Group()
+        self.fra_s = Particles(256)
         self.alpha = 0
         self.ap_speed = 1
         self.alpha_max = 255
@@ -1138,7 +867,7 @@ class ScreenSaver:
         self.canvas.fill('black')
         for s_brick in self.group:
             s_brick.draw(self.canvas)
-        self.fra_s.draw(self.canvas)
+        self.fra_s.draw(self.canvas, fragment_images())
         if self.alpha < self.alpha_max:
             self.canvas.set_alpha(self.alpha)
         surface.blit(self.canvas, (0, 0))
@@ -1148,22 +877,23 @@ class ScreenSaver:
         self.random_add()
         for s_brick in self.group:
             s_brick.update()
-        self.fra_s.update()
+        self.fra_s.update(screen_size[1] + 50)
         self.remove_brick()
 
 
 class Info:
     def __init__(self, creator: 'Level'):
         self.creator = creator
-        self.font = pygame.font.SysFont('', 40)
+        self.font = get_font('', 40)
         self.hp_bg1 = pygame.rect.Rect(0, 0, 120, 40)
         self.hp_bg2 = self.hp_bg1.inflate(-10, -10)
-        self.hp_image = self.font.render(f'HP: {self.creator.player.health}', True, 'black')
+        self.hp_value = self.creator.sim.player.health
+        self.hp_image = render_text(self.font, f'HP: {self.hp_value}', 'black')
         self.hp_rect = self.hp_image.get_rect(center=self.hp_bg2.center)
         self.dp_bg1 = pygame.rect.Rect(screen_size[0] - 120, 0, 120, 40)
         self.dp_bg2 = self.dp_bg1.inflate(-10, -10)
-        self.dp_value = (creator.bricks.floor - 1) * 100 + self.creator.player.gird_pos[1] + 1
-        self.dp_image = self.font.render(f'DP: {self.dp_value}', True, 'black')
+        self.dp_value = self.creator.sim.depth()
+        self.dp_image = render_text(self.font, f'DP: {self.dp_value}', 'black')
         self.dp_rect = self.dp_image.get_rect(center=self.dp_bg1.center)
 
     def draw(self, surface):
@@ -1177,67 +907,102 @@ class Info:
         surface.blit(self.dp_image, self.dp_rect)
 
     def update(self):
+        """数值变化时才重新渲染"""
         # HP
-        self.hp_image = self.font.render(f'HP: {self.creator.player.health}', True, 'black')
-        self.hp_rect = self.hp_image.get_rect(center=self.hp_bg2.center)
+        if self.hp_value != self.creator.sim.player.health:
+            self.hp_value = self.creator.sim.player.health
+            self.hp_image = render_text(self.font, f'HP: {self.hp_value}', 'black')
+            self.hp_rect = self.hp_image.get_rect(center=self.hp_bg2.center)
         # DP
-        self.dp_value = (self.creator.bricks.floor - 1) * 100 + self.creator.player.gird_pos[1] + 1
-        self.dp_image = self.font.render(f'DP: {self.dp_value}', True, 'black')
-        self.dp_rect = self.dp_image.get_rect(center=self.dp_bg1.center)
+        dp_value = self.creator.sim.depth()
+        if self.dp_value != dp_value:
+            self.dp_value = dp_value
+            self.dp_image = render_text(self.font, f'DP: {self.dp_value}', 'black')
+            self.dp_rect = self.dp_image.get_rect(center=self.dp_bg1.center)
 
 
 class SmallMap:
-    bri_images: Tuple[pygame.Surface, ...] = (
-        pygame.image.load('image/map/brick/red.png'),
-        pygame.image.load('image/map/brick/yellow.png'),
-        pygame.image.load('image/map/brick/green.png'),
-        pygame.image.load('image/map/brick/blue.png'),
-        pygame.image.load('image/map/brick/purple.png'),
-        pygame.image.load('image/map/brick/orange.png'),
-        pygame.image.load('image/map/brick/pink.png'),
-        pygame.image.load('image/map/brick/indigo.png'),
-        pygame.image.load('image/map/brick/stone.png')
-    )
-    cry_images: Tuple[pygame.Surface, ...] = (
-        pygame.image.load('image/map/crystal/red.png'),
-        pygame.image.load('image/map/crystal/yellow.png'),
-        pygame.image.load('image/map/crystal/green.png'),
-        pygame.image.load('image/map/crystal/blue.png'),
-        pygame.image.load('image/map/crystal/purple.png'),
-        pygame.image.load('image/map/crystal/orange.png'),
-        pygame.image.load('image/map/crystal/pink.png'),
-        pygame.image.load('image/map/crystal/indigo.png'),
-        pygame.image.load('image/map/crystal/stone.png')
-    )
+    """小地图保存在持久的image上，每次更新只重画有变化的格子，每帧只画闪烁的玩家"""
+    cell_len = 7
 
     def __init__(self, creator: 'Level'):
         self.creator = creator
-        self.image = pygame.Surface((70, 665))
+        # 小地图显示[map_top, map_top + map_rows)行
+        self.map_rows = 95
+        self.image = pygame.Surface((world_size[0] * self.cell_len, self.map_rows * self.cell_len))
+        self.image.fill('black')
         self.rect = self.image.get_rect(center=(full_size[0] // 2, full_size[1] // 2))
-        self.group2: list[list[Union[int, None]]] = []
         self.flash = 6
-        self.player_rect = pygame.Rect(self.creator.player.gird_pos[0] * 7, self.creator.player.gird_pos[1] * 7, 7, 7)
+        self.player_rect = pygame.Rect(self.creator.sim.player.gird_pos[0] * self.cell_len,
+                                       self.creator.sim.player.gird_pos[1] * self.cell_len, self.cell_len, self.cell_len)
+        self.map_top = 0
+        self.width = world_size[0]
+        # image上每格当前画的内容，按行储存：None为空，小于32为砖块颜色，否则为水晶颜色+32，-1代表需要重画
+        self.cells: list[Union[int, None]] = [None] * (self.width * self.map_rows)
         self.update_time = 0
         self.update_cool = 10
+        # 每次闪烁或更新地图时加一
+        self.revision = 0
         self._update_map()
         self._update_player()
 
+    def _set_map_top(self):
+        """跟随玩家，但不超出这一层的sub_brick"""
+        self.map_top = min(max(self.creator.sim.player.gird_pos[1] - self.map_rows // 2, 0),
+                           max(world_size[1] - sub_rows - self.map_rows, 0))
+
+    def _scroll_map(self, old_top: int):
+        """map_top改变时平移image，移入的行标记为需要重画"""
+        shift = self.map_top - old_top
+        if not shift:
+            return
+        moved = min(abs(shift), self.map_rows) * self.width
+        self.image.scroll(0, -shift * self.cell_len)
+        if shift > 0:
+            self.cells = self.cells[moved:] + [-1] * moved
+        else:
+            self.cells = [-1] * moved + self.cells[:len(self.cells) - moved]
+
+    def _map_cells(self) -> list[Union[int, None]]:
+        """按砖块和水晶得到每格应画的内容，不在内存中的行和sub_brick为None"""
+        grid = self.creator.sim.field.grid
+        cells = []
+        for gy in range(self.map_top, self.map_top + self.map_rows):
+            if grid.top <= gy < grid.bottom:
+                start = grid.index(0, gy)
+                cells.extend(None if color in (BrickGrid.EMPTY, 31) else color
+                             for color in grid.color[start:start + grid.width])
+            else:
+                cells.extend([None] * self.width)
+        for cry in self.creator.sim.crystals.group:
+            if self.map_top <= cry.gird_pos[1] < self.map_top + self.map_rows:
+                cells[(cry.gird_pos[1] - self.map_top) * self.width + cry.gird_pos[0]] = cry.color + 32
+        return cells
+
+    def _draw_cell(self, index: int, color: Union[int, None]):
+        gy, gx = divmod(index, self.width)
+        pos = (gx * self.cell_len, gy * self.cell_len)
+        self.image.fill('black', (pos, (self.cell_len, self.cell_len)))
+        if color is None:
+            return
+        if color < 32:
+            self.image.blit(convert_image(get_asset('map/brick')[color]), pos)
+        else:
+            self.image.blit(convert_image(get_asset('map/crystal')[color - 32], True), pos)
+
     def _update_map(self):
-        self.group2.clear()
-        for g1 in self.creator.bricks.b_list2:
-            group1 = []
-            for bri in g1:
-                if bri == 0:
-                    group1.append(None)
-                elif bri.color != 31:
-                    group1.append(bri.color)
-            self.group2.append(group1)
-        for cry in self.creator.crystals.group:
-            self.group2[cry.gird_pos[0]][cry.gird_pos[1]] = cry.color + 32
+        old_top = self.map_top
+        self._set_map_top()
+        self._scroll_map(old_top)
+        cells = self._map_cells()
+        for index, (old, new) in enumerate(zip(self.cells, cells)):
+            if old != new:
+                self._draw_cell(index, new)
+        self.cells = cells
 
     def _update_player(self):
-        self.player_rect.x = self.creator.player.gird_pos[0] * 7
-        self.player_rect.y = self.creator.player.gird_pos[1] * 7
+        self.player_rect.x = self.creator.sim.player.gird_pos[0] * self.cell_len
+        self.player_rect.y = (self.creator.sim.player.gird_pos[1] - self.map_top) * self.cell_len
 
     def update(self):
         self.update_time += 1
@@ -1248,27 +1013,18 @@ class SmallMap:
                 self.flash = 6
             self._update_map()
             self._update_player()
-
-    def _draw_map(self):
-        for gx, group1 in enumerate(self.group2):
-            for gy, color in enumerate(group1):
-                if color is None:
-                    continue
-                if color < 32:
-                    self.image.blit(self.__class__.bri_images[color], (gx * 7, gy * 7))
-                else:
-                    self.image.blit(self.__class__.cry_images[color - 32], (gx * 7, gy * 7))
+            self.revision += 1
 
     def draw(self, surface: pygame.Surface):
-        self.image.fill('black')
-        self._draw_map()
-        if self.flash > 3:
-            pygame.draw.rect(self.image, 'white', self.player_rect)
         surface.blit(self.image, self.rect)
+        if self.flash > 3:
+            pygame.draw.rect(surface, 'white', self.player_rect.move(self.rect.topleft).clip(self.rect))
 
 
 class Level:
     _instance: Union['Level', None] = None
+    # 在后台产生下一层的工作线程
+    planner = ThreadPoolExecutor(max_workers=1)
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
@@ -1282,26 +1038,41 @@ class Level:
     @classmethod
     def enter(cls):
         instance: 'Level' = cls()
-        if Game.get_inst().archive:
-            cls._instance.load(Game.get_inst().archive)
+        game = Game.get_inst()
+        if game.archive:
+            cls._instance.load(game.archive)
+        if game.record_path:
+            instance.sim.recording = Recording(instance.sim.seed, dict(game.archive))
+        if instance.replay is not None:
+            instance.status = 0
         return instance
 
     def __init__(self):
-        self.player = Player(randint(0, 9), -1)
-        self.bricks = Bricks()
-        self.crystals = Crystals()
-        if not Game.get_inst().archive:
-            self.set_floor()
-        self.backpack = Backpack()
+        game = Game.get_inst()
+        # 重放时用录像的种子，每一步的keys也从录像中读取
+        self.replay: Union[Iterator[int], None] = iter(game.replay) if game.replay else None
+        # 游戏状态都在sim中，下面的组件只负责绘制
+        self.sim = Simulation(game.replay.seed if game.replay else None, planner=self.__class__.planner)
+        # 碎片、烟花、音效的随机也由种子决定，重放的画面与录制时相同
+        seed(self.sim.seed)
+        self.player = Player(self.sim.player)
+        self.bricks = Bricks(self.sim.field)
+        self.crystals = Crystals(self.sim.crystals)
+        self.backpack = Backpack(self.sim.bag)
         self.fragments = Fragments()
+        if not game.archive:
+            self.sim.start()
+            self._handle_events()
         self.info = Info(self)
-        self.need_next = False
+        # 下一步交给sim的按住的键，以及菜单中发出的命令
+        self.keys = 0
+        self.commands = 0
         self.status: int = 0
         self.pause_menu = PauseMenu()
         self.input_idle = 0
         self.sleep_time = 3600
         self.screensaver: Union['ScreenSaver', None] = None
-        self.background = pygame.image.load('image/background.png')
+        self.background = convert_image(get_asset('background'))
         self.bg_large = pygame.transform.scale(self.background, full_size)
         self.canvas = pygame.Surface(screen_size)
         self.triple_black = pygame.Surface(triple_size)
@@ -1312,54 +1083,39 @@ class Level:
         self.small_map = SmallMap(self)
 
     def load(self, archive: dict):
-        self.player.load(archive['player'])
-        self.bricks.load(archive['bricks'])
-        self.crystals.load(archive['crystals'])
-        self.backpack.load(archive['backpack'])
+        self.sim.load(archive)
         self.fragments.load(archive['fragments'])
         if 'level_status' in archive:
             self.status = archive['level_status']
-
-    def _set_bricks_crystals(self):
-        """产生砖块，水晶"""
-        self.bricks.b_list2.clear()
-        self.crystals.group.clear()
-        for gx in range(10):
-            b_list1: list[Union['Soil', 'Stone', int]] = []
-            for gy in range(100):
-                if 95 <= gy < 100:
-                    b_list1.append(create_brick(31, [gx, gy]))
-                elif randint(0, 99):
-                    b_list1.append(create_brick(choice(self.bricks.colors), [gx, gy]))
-                else:
-                    b_list1.append(0)
-                    Crystal(choice(self.bricks.colors), [gx, gy])
-            self.bricks.b_list2.append(b_list1)
-
-    def set_floor(self):
-        """产生砖块，水晶和砖块的chain"""
-        self.bricks.colors = sample(range(9), 5)
-        self.bricks.floor += 1
-        self._set_bricks_crystals()
-        # 设定chain
-        self.bricks.update_chain2()
-
-    def next_floor(self):
-        """生成下一层"""
-        if not self.need_next:
-            return
-        self.need_next = False
-        self._fireworks()
-        # 改变玩家位置
-        self.player.gird_pos[1] = -6
-        self.player.pos = pixel_units(self.player.gird_pos)
-        # 重置floor
-        self.set_floor()
+        self._handle_events()
+
+    def _handle_events(self):
+        """把sim中发生的事交给绘制和声音"""
+        for event in self.sim.events:
+            kind = event[0]
+            if kind == 'destroy':
+                _, color, gx, gy = event
+                self.fragments.produce(color, [gx * brick_len + brick_len // 2, gy * brick_len + brick_len // 2])
+            elif kind == 'sound':
+                play_sound(event[1])
+            elif kind == 'next_floor':
+                self._fireworks()
+            self.bricks.handle(event)
+        self.sim.events.clear()
+
+    def use_crystal(self, color: int):
+        """下一步使用水晶，并重新开始破坏的冷却"""
+        self.commands |= (color + 1) << KEY_CRYSTAL_SHIFT | KEY_DESTROY_COOL
+
+    def close(self):
+        """离开关卡：关闭sim中逐出块的临时文件"""
+        self.sim.close()
 
     def _fireworks(self):
         """目前仅用于在换层时产生粒子效果"""
-        for _, __ in itertools.product(range(9), range(-5, -1)):
-            Fragment.produce(choice(self.bricks.colors), [_ * brick_len, __ * brick_len])
+        for _, __ in itertools.product(range(world_size[0] - 1), range(-5, -1)):
+            center = [_ * brick_len + brick_len // 2, __ * brick_len + brick_len // 2]
+            self.fragments.produce(choice(self.sim.field.colors), center)
 
     def _input_s0(self, key: int):
         """statues是0时的操作"""
@@ -1379,19 +1135,27 @@ class Level:
             self.backpack.select(key)
 
     def input(self):
-        """包含所有可控制组件的控制模块：level，backpack，player"""
+        """包含所有可控制组件的控制模块：level，backpack，以及交给sim的按键"""
+        if self.replay is not None:
+            # 重放时不理会键盘，keys（包括命令）都来自录像
+            self.keys = next(self.replay, 0)
+            self.input_idle = 0
+            return
+        self.keys = 0
         for event in Game.events:
             if event.type != pygame.KEYDOWN:
                 continue
             if event.key != pygame.K_F4:
                 self.input_idle = 0
             if self.screensaver:
-                self.player.move_begin()
-                self.player.destroy_begin()
+                self.commands |= KEY_MOVE_COOL | KEY_DESTROY_COOL
                 return
             self._input_status(event.key)
         if self.status == 0:
-            self.player.input()
+            pressed = pygame.key.get_pressed()
+            self.keys = sum(bit for key, bit in key_bits.items() if pressed[key])
+            if self.keys:
+                self.input_idle = 0
 
     def _saver_draw_small(self, screen: pygame.Surface):
         if self.screensaver.alpha < 255:
@@ -1420,34 +1184,56 @@ class Level:
             self.backpack.draw(self.canvas)
         screen.blit(self.canvas, (0, 0))
 
-    def _draw_face0(self, face: pygame.Surface):
-        self.canvas0 = self.bg_large.copy()
+    def _face1_key(self) -> Union[tuple, None]:
+        """游戏画面的内容标识，有粒子或下落的水晶时每帧都在变化"""
+        player = self.sim.player
+        if self.fragments.count or self.sim.crystals.falling:
+            return None
+        return (get_camera(), tuple(lerp(player.last_pos, player.pos)), player.status, player.health,
+                self.sim.field.floor, self.bricks.revision, self.sim.crystals.revision)
+
+    def _face2_key(self) -> tuple:
+        """菜单画面的内容标识，只有背景时不变"""
+        if self.status == 1:
+            return 'pause', tuple(self.pause_menu.a_rect)
+        if self.status in [2, 3]:
+            return 'bag', tuple(self.backpack.arrow_rect), tuple(bag.num for bag in self.backpack.bag_crystals)
+        return 'background',
+
+    def _draw_face0(self, face: 'Face'):
+        if face.unchanged(('map', self.small_map.revision)):
+            return
+        self.canvas0 = face.image
+        self.canvas0.blit(self.bg_large, (0, 0))
         self.small_map.draw(self.canvas0)
-        face.blit(self.canvas0, (0, 0))
 
-    def _draw_face1(self, face: pygame.Surface):
-        self.canvas1 = self.background.copy()
+    def _draw_face1(self, face: 'Face'):
+        if face.unchanged(self._face1_key()):
+            return
+        self.canvas1.blit(self.background, (0, 0))
         self.bricks.draw(self.canvas1)
         self.crystals.draw(self.canvas1)
         self.player.draw(self.canvas1)
         self.fragments.draw(self.canvas1)
         self.info.draw(self.canvas1)
-        face.blit(pygame.transform.scale(self.canvas1, full_size), (0, 0))
+        pygame.transform.scale(self.canvas1, full_size, face.image)
 
-    def _draw_face2(self, face: pygame.Surface):
-        self.canvas2 = self.background.copy()
+    def _draw_face2(self, face: 'Face'):
+        if face.unchanged(self._face2_key()):
+            return
+        self.canvas2.blit(self.background, (0, 0))
         if self.status == 1:
             self.pause_menu.draw(self.canvas2)
         if self.status in [2, 3]:
             self.backpack.draw(self.canvas2)
-        face.blit(pygame.transform.scale(self.canvas2, full_size), (0, 0))
+        pygame.transform.scale(self.canvas2, full_size, face.image)
 
-    def _draw_faces(self, faces: Tuple[pygame.Surface, ...]):
+    def _draw_faces(self, faces: Tuple['Face', ...]):
         self._draw_face0(faces[0])
         self._draw_face1(faces[1])
         self._draw_face2(faces[2])
 
-    def draw(self, canvas: Union[pygame.Surface, Tuple[pygame.Surface, ...]]):
+    def draw(self, canvas: Union[pygame.Surface, Tuple['Face', ...]]):
         if not self.screensaver:
             if type(canvas) == pygame.Surface:
                 self._draw_screen(canvas)
@@ -1485,15 +1271,17 @@ class Level:
         if not self.screensaver:
             if self.status == 1:
                 self.pause_menu.update()
+                self.sim.hold()
             else:
-                self.bricks.update()
-                self.crystals.update()
+                self.sim.step(self.keys | self.commands)
+                self.commands = 0
+                self._handle_events()
                 self.fragments.update()
-                self.player.update()
             self.info.update()
             self.backpack.update()
         else:
             self.screensaver.update()
+            self.sim.hold()
 
     def _update_full(self):
         if self.status == 0:
@@ -1504,19 +1292,19 @@ class Level:
         if Game.whether_full():
             self._update_full()
 
-    def run(self, canvas: pygame.Surface):
+    def step(self):
+        """模拟一步，与绘制分开，由Game按固定的时间间隔调用"""
         self.input()
         self.update()
-        self.draw(canvas)
-        self.next_floor()
 
 
 class MenuAnimation:
-    a_kind: Tuple[pygame.Surface, ...] = Brick.soil_image + Brick.stone_image + Fragment.f_kind + Crystal.c_kind
+    # 动画可选的图片组，包括石头，所以石头的图片在菜单中就会读取
+    a_kind = ('brick/soil', 'brick/stone', 'fragment', 'crystal')
 
     def __init__(self):
-        self.image = choice(self.__class__.a_kind).convert_alpha()
-        self.image.set_alpha(127)
+        kinds = tuple(itertools.chain.from_iterable(map(get_asset, self.__class__.a_kind)))
+        self.image = convert_image(choice(kinds), True, 127)
         self.side = choice(('left', 'right'))
         self.rect = self.image.get_rect(center=(0, randint(-20, screen_size[1] + 20)))
         if self.side == 'left':
@@ -1589,7 +1377,7 @@ class LogoBrick:
 
     def __init__(self, order: int, color: int):
         """依照序号和颜色产生logo上的砖块"""
-        self.image = pygame.image.load(f'image/menu/logos/{self.__class__.order_path(order)}{color}.png')
+        self.image = convert_image(get_asset(f'menu/logos/{self.__class__.order_path(order)}{color}'), True)
         self.rect = self.image.get_rect(topleft=(60 + order // 2 * 70, 70 + order % 2 * 70))
 
     def draw(self, surface: pygame.Surface):
@@ -1599,16 +1387,16 @@ class LogoBrick:
 class Logo:
     def __init__(self):
         """speed: 进入或消失时的移动速度（不是消失速度）"""
-        self.image = pygame.image.load('image/menu/logos/bg.png')
+        self.image = convert_image(get_asset('menu/logos/bg'), True)
         self.rect = self.image.get_rect(center=(screen_size[0] // 2, 140))
         self.bricks: Tuple['LogoBrick', ...] = tuple(LogoBrick(o, c) for o, c in enumerate(Game.get_inst().logo_color))
         self.speed = 2
         if Game.get_inst().bug_pos:
             self.b_image = pygame.transform.flip(
-                pygame.image.load('image/menu/player_l.png').convert_alpha(), True, False)
+                convert_image(get_asset('menu/player_l'), True), True, False)
             self.b_rect = self.b_image.get_rect(center=self.bricks[6].rect.topright)
         else:
-            self.b_image = pygame.image.load('image/menu/player_l.png').convert_alpha()
+            self.b_image = convert_image(get_asset('menu/player_l'), True)
             self.b_rect = self.b_image.get_rect(center=self.bricks[0].rect.topleft)
         self.distance = self.speed * ceil(255 / Menu.get_inst().ah_speed)
 
@@ -1640,7 +1428,7 @@ class Logo:
 class Button:
     def __init__(self, name: str, order: int):
         """:param name: 只填不带后缀的文件名"""
-        self.image = pygame.image.load(f'image/menu/{name}.png').convert_alpha()
+        self.image = convert_image(get_asset(f'menu/{name}'), True)
         self.rect = self.image.get_rect(center=(screen_size[0] // 2, screen_size[1] // 2 + order * 100))
 
 
@@ -1689,7 +1477,7 @@ class ButtonComplex:
         self.speed = 2
         self.buttons = Buttons(self.speed)
         self.buttons_pos = self.buttons.get_pos()
-        self.arrow_image = pygame.image.load('image/menu/arrow.png').convert_alpha()
+        self.arrow_image = convert_image(get_asset('menu/arrow'), True)
         self.a_rect = self.arrow_image.get_rect(midright=self.buttons_pos[self.selection])
         self.a_speed = -1
         self.distance = self.speed * ceil(255 / Menu.get_inst().ah_speed)
@@ -1747,7 +1535,7 @@ class ButtonComplex:
         self.swing()
 
     def draw(self, surface: pygame.Surface):
-        self.buttons.draw(surface)
+        """只画箭头，按钮由Menu合成在front上"""
         surface.blit(self.arrow_image, self.a_rect)
 
 
@@ -1777,8 +1565,11 @@ class Menu:
         self.animations = MenuAnimations()
         self.logo = Logo()
         self.bon_cx = ButtonComplex()
-        self.background = pygame.image.load('image/background.png').convert_alpha()
+        self.background = convert_image(get_asset('background'), True)
         self.bg_copy = self.background.copy()
+        # logo和按钮合成的图层，只在它们移动时重新合成
+        self.front = pygame.Surface(screen_size, pygame.SRCALPHA)
+        self.front_key = None
         self.alpha: int = 255
 
     def dec_alpha(self):
@@ -1805,10 +1596,21 @@ class Menu:
             self.logo.appear()
             self.bon_cx.appear()
 
+    def _compose_front(self):
+        """logo和按钮只在进入、消失时移动，其余时候直接使用合成好的front"""
+        key = (self.logo.rect.topleft, self.bon_cx.buttons.group[0].rect.topleft)
+        if key == self.front_key:
+            return
+        self.front_key = key
+        self.front.fill((0, 0, 0, 0))
+        self.logo.draw(self.front)
+        self.bon_cx.buttons.draw(self.front)
+
     def _draw_face(self, surface: pygame.Surface):
         self.bg_copy = self.background.copy()
         self.animations.draw(self.bg_copy)
-        self.logo.draw(self.bg_copy)
+        self._compose_front()
+        self.bg_copy.blit(self.front, (0, 0))
         self.bon_cx.draw(self.bg_copy)
         if self.alpha < 255:
             self.bg_copy.set_alpha(self.alpha)
@@ -1816,20 +1618,27 @@ class Menu:
             self.bg_copy = pygame.transform.scale(self.bg_copy, full_size)
         surface.blit(self.bg_copy, (0, 0))
 
-    def draw(self, canvas: Union[pygame.Surface, Tuple[pygame.Surface, ...]]):
+    def draw(self, canvas: Union[pygame.Surface, Tuple['Face', ...]]):
         if type(canvas) == pygame.Surface:
             self._draw_face(canvas)
         elif type(canvas) == tuple:
-            self._draw_face(canvas[1])
-
-    def run(self, surface: pygame.Surface):
+            # 两侧只有背景，只画一次
+            for face in (canvas[0], canvas[2]):
+                if not face.unchanged('background'):
+                    face.image.blit(Game.get_inst().bg_large, (0, 0))
+            # 中间有动画，每帧都画
+            canvas[1].unchanged(None)
+            canvas[1].image.blit(Game.get_inst().bg_large, (0, 0))
+            self._draw_face(canvas[1].image)
+
+    def step(self):
+        """模拟一步，与绘制分开"""
         if self.need_disappear:
             self.disappear()
         else:
             self.appear()
             self.bon_cx.update()
             self.animations.update()
-        self.draw(surface)
 
 
 class Face:
@@ -1840,6 +1649,18 @@ class Face:
         self.image = pygame.Surface(full_size)
         self.rect = self.image.get_rect(
             midleft=(self.__class__.gap + order * self.__class__.dist, display_size[1] // 2))
+        # 上一次画的内容的标识，没变时不必重画和缩放
+        self.key = None
+        # 重画过，需要贴到屏幕上
+        self.dirty = True
+
+    def unchanged(self, key) -> bool:
+        """key与上一次相同时返回True，否则记下key。key为None代表内容每帧都在变化"""
+        if key is not None and key == self.key:
+            return True
+        self.key = key
+        self.dirty = True
+        return False
 
 
 class Faces:
@@ -1848,18 +1669,169 @@ class Faces:
         self.face1 = Face(1)
         self.face2 = Face(2)
         self.group: Tuple['Face', ...] = (self.face0, self.face1, self.face2)
+        self.cleared = False
 
-    def draw(self, screen: pygame.Surface):
+    def reset(self):
+        """屏幕被覆盖或画面换了主人，下一帧全部重画"""
+        self.cleared = False
         for face in self.group:
-            screen.blit(face.image, face.rect)
+            face.key = None
+            face.dirty = True
 
-    def draw_on(self, image: pygame.Surface, rect: Union[pygame.Rect, Tuple[int, int]]):
+    def draw(self, screen: pygame.Surface):
+        """只把重画过的面贴到屏幕上"""
+        if not self.cleared:
+            screen.fill('black')
+            self.cleared = True
         for face in self.group:
-            face.image.blit(image, rect)
+            if face.dirty:
+                screen.blit(face.image, face.rect)
+                face.dirty = False
+
+
+class Profiler:
+    """
+    F3开关的逐帧分析：打开时把hooks中的函数换成计时的版本，关闭时换回原来的函数，所以关闭时没有开销
+    画面左下角显示最近frames_shown帧中各阶段的平均用时（包含嵌套在其中的阶段）和帧时间曲线
+    F9把记录下的各阶段导出为Chrome的trace event格式，可以用chrome://tracing或Perfetto打开
+    """
+    # 计时的函数：类名.方法名，或pygame的模块名.函数名，按嵌套关系排列
+    hooks = ('Game.step', 'Level.step', 'Simulation.step', 'Level._handle_events', 'Fragments.update',
+             'SmallMap.update', 'ScreenSaver.update', 'Menu.step',
+             'Game.draw', 'Level.draw', 'Bricks.draw', 'Crystals.draw', 'Player.draw', 'Fragments.draw',
+             'SmallMap.draw', 'Info.draw', 'Backpack.draw', 'ScreenSaver.draw', 'Menu.draw', 'Faces.draw',
+             'transform.scale', 'display.update')
+    trace_path = 'trace.json'
+    frames_shown = 120
+    # 导出时最多保留的阶段数，更早的丢弃
+    max_events = 200000
+    # 每隔多少帧重新渲染一次文字
+    text_interval = 15
+    line_height = 15
+    graph_height = 60
+
+    def __init__(self):
+        self.enabled = False
+        # 换掉的函数：(所属的类或模块, 名称, 原来在其中的值)
+        self._originals: list[tuple] = []
+        # 每次调用：(名称, 嵌套深度, 开始, 用时)，单位纳秒。深度为-1的是整帧
+        self.events: deque[Tuple[str, int, int, int]] = deque(maxlen=self.__class__.max_events)
+        self.depth = 0
+        # 这一帧中各阶段的总用时，以及各阶段的嵌套深度
+        self.totals: dict[str, int] = {}
+        self.depths: dict[str, int] = {}
+        self.history: deque[dict[str, int]] = deque(maxlen=self.__class__.frames_shown)
+        self.frame_times: deque[float] = deque(maxlen=self.__class__.frames_shown)
+        self.frame_start = 0
+        self.frame_count = 0
+        self.font = get_font('', 18)
+        # 不透明的底色，每次都完整地盖住上一次画的内容
+        self.image = pygame.Surface((2 * self.__class__.frames_shown,
+                                     (len(self.__class__.hooks) + 1) * self.__class__.line_height + 4))
+        self.graph = pygame.Surface((2 * self.__class__.frames_shown, self.__class__.graph_height))
+
+    def _timed(self, name: str, func: Callable) -> Callable:
+        events = self.events
+        totals = self.totals
+        depths = self.depths
+        clock = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            depth = self.depth
+            self.depth = depth + 1
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = clock() - start
+                self.depth = depth
+                events.append((name, depth, start, duration))
+                totals[name] = totals.get(name, 0) + duration
+                depths.setdefault(name, depth)
+
+        return timed
+
+    def _hook(self):
+        for hook in self.__class__.hooks:
+            owner_name, name = hook.split('.')
+            owner = globals().get(owner_name) or getattr(pygame, owner_name)
+            self._originals.append((owner, name, vars(owner).get(name)))
+            setattr(owner, name, self._timed(hook, getattr(owner, name)))
+
+    def _unhook(self):
+        for owner, name, original in reversed(self._originals):
+            if original is None:
+                # 原来是从父类继承的
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self._originals.clear()
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        if self.enabled:
+            self.depth = 0
+            self.totals.clear()
+            self.history.clear()
+            self.frame_times.clear()
+            self.frame_count = 0
+            self.frame_start = time.perf_counter_ns()
+            self._hook()
+        else:
+            self._unhook()
+
+    def _render_text(self):
+        history = self.history
+        frames = max(len(history), 1)
+        lines = [f'frame {sum(self.frame_times) / frames:.2f} ms, max {max(self.frame_times, default=0):.2f} ms']
+        for name in self.__class__.hooks:
+            if name in self.depths:
+                mean = sum(totals.get(name, 0) for totals in history) / frames / 1e6
+                lines.append(f'{"  " * self.depths[name]}{name} {mean:.2f}')
+        self.image.fill('black')
+        for i, line in enumerate(lines):
+            self.image.blit(self.font.render(line, True, 'white'), (4, 2 + i * self.__class__.line_height))
+
+    def _draw_graph(self):
+        """帧时间曲线，顶部为三步的时间，黄线为一步的时间"""
+        height = self.__class__.graph_height
+        step_ms = 1000 / FPS
+        scale = height / (3 * step_ms)
+        self.graph.fill('black')
+        for i, ms in enumerate(self.frame_times):
+            bar = min(ms * scale, height)
+            pygame.draw.rect(self.graph, 'green' if ms <= step_ms else 'red', (2 * i, height - bar, 2, bar))
+        pygame.draw.line(self.graph, 'yellow', (0, height - step_ms * scale),
+                         (self.graph.get_width(), height - step_ms * scale))
+
+    def end_frame(self, screen: pygame.Surface):
+        """一帧结束：记下帧时间和这一帧各阶段的用时，在screen的左下角画出结果"""
+        now = time.perf_counter_ns()
+        self.events.append(('frame', -1, self.frame_start, now - self.frame_start))
+        self.frame_times.append((now - self.frame_start) / 1e6)
+        self.frame_start = now
+        self.history.append(dict(self.totals))
+        self.totals.clear()
+        if self.frame_count % self.__class__.text_interval == 0:
+            self._render_text()
+        self.frame_count += 1
+        self._draw_graph()
+        bottom = screen.get_height()
+        screen.blit(self.graph, (0, bottom - self.graph.get_height()))
+        screen.blit(self.image, (0, bottom - self.graph.get_height() - self.image.get_height()))
+
+    def export(self, path: str = trace_path):
+        """把记录下的各阶段写成Chrome trace event格式的json，时间单位为微秒"""
+        events = [{'name': name, 'cat': 'frame' if depth < 0 else 'stage', 'ph': 'X', 'ts': start / 1000,
+                   'dur': duration / 1000, 'pid': 0, 'tid': 0} for name, depth, start, duration in self.events]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
 
 
 class Game:
     events: Union[list[pygame.event.Event], None] = None
+    # 绘制时距上一步的时间占一步的比例，用于插值；模拟时为1
+    alpha: float = 1.0
     _instance: Union['Game', None] = None
 
     def __new__(cls, *args, **kwargs):
@@ -1875,19 +1847,24 @@ class Game:
     def whether_full(cls):
         return cls._instance.full_status
 
-    def __init__(self):
+    def __init__(self, record_path: Union[str, None] = None, replay: Union['Recording', None] = None,
+                 show: bool = True):
+        # 录制时每次进入关卡的录像写入record_path；重放时直接进入关卡，show为假时不绘制
+        self.record_path = record_path
+        self.replay = replay
+        self.show = show
         pygame.init()
         self.screen: pygame.Surface = pygame.display.set_mode(screen_size)
         self.clock = pygame.time.Clock()
-        self.bg = pygame.image.load('image/background.png').convert()
+        self.bg = convert_image(get_asset('background'))
         self.bg_large = pygame.transform.scale(self.bg, full_size)
         self.background = self.bg
         pygame.display.set_caption('Center Adventure')
-        pygame.display.set_icon(pygame.image.load('image/player/player.png').convert_alpha())
+        pygame.display.set_icon(convert_image(get_asset('player/player'), True))
         self.logo_color: list[int] = sample(range(8), 8)
         self.bug_pos: int = randint(0, 1)
-        self.archive: dict = read_archive()
-        if 'level_status' in self.archive:
+        self.archive: dict = (replay.archive or {}) if replay else read_archive()
+        if replay or 'level_status' in self.archive:
             self.status: int = 1
             self.menu: Union['Menu', None] = None
             self.level: Union['Level', None] = Level.enter()
@@ -1897,21 +1874,33 @@ class Game:
             self.level: Union['Level', None] = None
         self.full_status: bool = False
         self.faces = Faces()
+        self.profiler = Profiler()
 
     def level_io(self):
         if self.status == 1 and not self.level:
             self.menu = None
             self.level = Level.enter()
+            self.faces.reset()
         elif self.status == 0 and not self.menu:
             self.menu = Menu.enter()
             self.archive = get_archive()
+            self._save_recording()
+            self.level.close()
             self.level = None
+            self.faces.reset()
+
+    def _save_recording(self):
+        if self.record_path and self.level is not None:
+            self.level.sim.recording.save(self.record_path)
 
     def _quit(self):
-        if self.status == 1:
-            write_archive(get_archives())
-        else:
-            write_archive(self.archive)
+        self._save_recording()
+        # 重放不改动存档
+        if not self.replay:
+            if self.status == 1:
+                write_archive(get_archives())
+            else:
+                write_archive(self.archive)
         pygame.quit()
         sys.exit()
 
@@ -1919,7 +1908,7 @@ class Game:
         if not self.full_status:
             self.full_status = True
             pygame.display.set_mode(display_size, flags=pygame.FULLSCREEN | pygame.HWSURFACE)
-            self.screen.fill('black')
+            self.faces.reset()
         else:
             self.full_status = False
             pygame.display.set_mode(screen_size)
@@ -1930,36 +1919,272 @@ class Game:
                 self._quit()
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
                 self._full_change()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.profiler.toggle()
+                self.faces.reset()
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F9:
+                self.profiler.export()
+
+    def _get_canvas(self) -> Union[pygame.Surface, Tuple['Face', ...]]:
+        return self.faces.group if self.full_status else self.screen
+
+    def step(self):
+        """模拟一步"""
+        self.level_io()
+        if self.level is not None:
+            self.level.step()
+        elif self.menu is not None:
+            self.menu.step()
 
-    def _get_canvas(self) -> Union[pygame.Surface, Tuple[pygame.Surface, ...]]:
-        return tuple(map(lambda face: face.image, self.faces.group)) if self.full_status else self.screen
-
-    def update_draw(self):
-        self.screen.fill('black')
+    def draw(self, alpha: float):
+        """绘制一帧，alpha为上一步之后经过的时间占一步的比例"""
+        self.__class__.alpha = alpha
         if not self.full_status:
+            self.screen.fill('black')
             self.screen.blit(self.background, (0, 0))
-        else:
-            self.faces.draw_on(self.bg_large, (0, 0))
         if self.level is not None:
-            self.level.run(self._get_canvas())
+            self.level.draw(self._get_canvas())
         elif self.menu is not None:
-            self.menu.run(self._get_canvas())
+            self.menu.draw(self._get_canvas())
+        self.__class__.alpha = 1.0
         if self.full_status:
             if self.level and self.level.screensaver:
                 self.screen.blit(pygame.transform.scale(self.level.cv_copy, display_size), (0, 0))
+                self.faces.reset()
             else:
                 self.faces.draw(self.screen)
 
+    def idle(self) -> bool:
+        """关卡进入屏保时为空闲"""
+        return self.level is not None and self.level.screensaver is not None
+
+    def _get_events(self) -> list[pygame.event.Event]:
+        if not self.idle():
+            return pygame.event.get()
+        # 空闲时阻塞等待事件，最多等一帧的时间；有按键时立即醒来
+        event = pygame.event.wait(1000 // IDLE_FPS)
+        return ([] if event.type == pygame.NOEVENT else [event]) + pygame.event.get()
+
     def run(self):
+        """固定步长的模拟：按经过的时间模拟若干步，再绘制一帧。绘制变慢时丢帧，游戏速度不变"""
+        step_ms = 1000 / FPS
+        lag = 0.0
+        # 还没交给模拟的事件，绘制比模拟快时留到下一步
+        pending: list[pygame.event.Event] = []
+        self.clock.tick()
         while True:
-            self.__class__.events = pygame.event.get()
+            events = self._get_events()
+            self.__class__.events = events
             self.control()
-            self.level_io()
-            self.update_draw()
-            self.clock.tick(FPS)
+            pending += events
+            # 待机时收到事件（如按键）立即恢复全速，不再睡完这一帧
+            fps = render_fps if events or not self.idle() else IDLE_FPS
+            lag = min(lag + self.clock.tick(fps), max_steps * step_ms)
+            while lag >= step_ms:
+                self.__class__.events, pending = pending, []
+                self.step()
+                lag -= step_ms
+            self.draw(lag / step_ms)
+            if self.profiler.enabled:
+                self.profiler.end_frame(self.screen)
             pygame.display.update()
 
+    def run_replay(self):
+        """不等待时钟，尽快按录像模拟每一步，show为真时每步绘制一帧。结束后打印结果和速度"""
+        start = time.perf_counter()
+        for _ in range(self.replay.steps):
+            self.__class__.events = pygame.event.get()
+            self.control()
+            self.__class__.events = []
+            self.step()
+            if self.show:
+                self.draw(1.0)
+                if self.profiler.enabled:
+                    self.profiler.end_frame(self.screen)
+                pygame.display.update()
+        elapsed = time.perf_counter() - start
+        print(self.level.sim.summary(), f'{self.replay.steps / max(elapsed, 1e-9):.0f} steps/s')
+        self.level.close()
+        pygame.quit()
+
+
+class Bench:
+    """
+    python main.py bench [结果文件]：在SDL的dummy驱动下运行脚本化的场景，结果以json输出
+    每个场景先预热，再逐帧计时（模拟一步、绘制一帧、display.update），
+    之后再开着tracemalloc跑一段统计每帧分配的内存。tracemalloc很慢，这些帧不计时
+    """
+    warmup = 60
+    frames = 600
+    alloc_frames = 120
+
+    def __init__(self):
+        # 重放模式直接进入关卡，不读写archive.json；每个场景的输入由_enter给出
+        self.game = Game(replay=Recording(0))
+        Game.events = []
+        self.results: dict[str, dict] = {}
+
+    def _enter(self, seed: int, keys: int) -> 'Level':
+        """用固定的种子开始新的一局，每一步都按住keys"""
+        game = self.game
+        game.replay = Recording(seed)
+        game.archive = {}
+        game.level.close()
+        game.level = Level.enter()
+        game.level.replay = itertools.repeat(keys)
+        game.faces.reset()
+        return game.level
+
+    def frame(self):
+        self.game.step()
+        self.game.draw(1.0)
+        pygame.display.update()
+
+    @staticmethod
+    def _percentile(sorted_: list[float], p: float) -> float:
+        return sorted_[max(ceil(p * len(sorted_)) - 1, 0)]
+
+    def measure(self, name: str, frame: Callable[[], None], prepare: Callable[[int], None] = lambda i: None):
+        """prepare(i)在每一帧之前调用，不计入用时和分配"""
+        for i in range(self.warmup):
+            prepare(i)
+            frame()
+        times = []
+        for i in range(self.frames):
+            prepare(i)
+            start = time.perf_counter()
+            frame()
+            times.append((time.perf_counter() - start) * 1000)
+        # 每帧分配的内存：帧内的峰值减去帧开始时的用量
+        allocs = []
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        for i in range(self.alloc_frames):
+            prepare(i)
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            frame()
+            allocs.append((tracemalloc.get_traced_memory()[1] - current) / 1024)
+        retained = (tracemalloc.get_traced_memory()[0] - base) / 1024
+        tracemalloc.stop()
+        times.sort()
+        allocs.sort()
+        self.results[name] = {
+            'mean_ms': round(sum(times) / len(times), 3),
+            'p95_ms': round(self._percentile(times, 0.95), 3),
+            'p99_ms': round(self._percentile(times, 0.99), 3),
+            'max_ms': round(times[-1], 3),
+            'alloc_peak_kib_mean': round(sum(allocs) / len(allocs), 1),
+            'alloc_peak_kib_p95': round(self._percentile(allocs, 0.95), 1),
+            'retained_kib': round(retained, 1)
+        }
+
+    def dig(self):
+        """一直向下挖"""
+        self._enter(1, KEY_DOWN | KEY_SPACE)
+        self.measure('dig', self.frame)
+
+    def crystal_destroy(self):
+        """玩家上下7行都填满同一种颜色，每一步都使用这种颜色的水晶"""
+        level = self._enter(2, 0)
+        sim = level.sim
+        color = sim.field.colors[0]
+
+        def prepare(_):
+            grid = sim.field.grid
+            gx, gy = sim.player.gird_pos
+            for y, x in itertools.product(range(max(gy - 7, grid.top), min(gy + 8, grid.bottom)), range(grid.width)):
+                if (x, y) != (gx, gy) and (x, y) not in sim.crystals.resting:
+                    grid.color[grid.index(x, y)] = color
+                    grid.health[grid.index(x, y)] = 0
+            sim.field.update_chain2()
+            level.bricks.handle(('rows', grid.top, grid.bottom))
+            sim.bag.nums[color] = 1
+            level.use_crystal(color)
+
+        self.measure('crystal_destroy', self.frame, prepare)
+
+    def floor_transition(self):
+        """每秒换一层：换层时的烟花，以及之后碎片落下的各帧"""
+        level = self._enter(3, KEY_DOWN | KEY_SPACE)
+
+        def prepare(i):
+            if i % FPS == 0:
+                level.sim.need_next = True
+
+        self.measure('floor_transition', self.frame, prepare)
+
+    def full_screen(self):
+        """全屏的三个画面"""
+        self._enter(4, KEY_DOWN | KEY_SPACE)
+        self.game._full_change()
+        self.measure('full_screen', self.frame)
+        self.game._full_change()
+
+    def screensaver(self):
+        """屏保中保持20个砖块"""
+        level = self._enter(5, 0)
+        # 从键盘读取输入（dummy驱动下没有按键），才会进入屏保
+        level.replay = None
+        level.input_idle = level.sleep_time
+
+        def prepare(_):
+            saver = level.screensaver
+            if saver:
+                saver.alpha = saver.alpha_max
+                while len(saver.group) < 20:
+                    SaverBrick(saver)
+
+        self.measure('screensaver', self.frame, prepare)
+
+    def save_load(self):
+        """先挖一段，再反复保存、读取完整的存档。每次之前都换回挖完时的状态，保存的总是同一个存档"""
+        level = self._enter(6, KEY_DOWN | KEY_SPACE)
+        for _ in range(20 * FPS):
+            self.frame()
+        archive = get_archive()
+
+        def prepare(_):
+            level.load(archive)
+            level.status = 0
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, archive_path)
+
+            def frame():
+                write_archive(get_archives(), path)
+                level.load(read_archive(path, None))
+
+            self.measure('save_load', frame, prepare)
+
+    def run(self, path: Union[str, None] = None):
+        for scenario in (self.dig, self.crystal_destroy, self.floor_transition, self.full_screen, self.screensaver,
+                         self.save_load):
+            scenario()
+        text = json.dumps({'python': sys.version.split()[0], 'pygame': pygame.version.ver, 'frames': self.frames,
+                           'scenarios': self.results}, indent=2)
+        if path:
+            with open(path, 'w') as f:
+                f.write(text)
+        else:
+            print(text)
+        self.game.level.close()
+        pygame.quit()
+
 
 if __name__ == '__main__':
-    game = Game()
-    game.run()
+    if sys.argv[1:2] == ['pack']:
+        AssetBundle.pack()
+    elif sys.argv[1:2] == ['bench']:
+        # python main.py bench [结果文件]
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        Bench().run(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif sys.argv[1:2] == ['replay']:
+        # python main.py replay 录像文件 [nodraw]
+        game = Game(replay=Recording.load(sys.argv[2]), show='nodraw' not in sys.argv[3:])
+        game.run_replay()
+    else:
+        # python main.py record 录像文件：录下每次进入关卡后的输入
+        game = Game(record_path=sys.argv[2] if sys.argv[1:2] == ['record'] else None)
+        game.run()